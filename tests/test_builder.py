@@ -0,0 +1,134 @@
+import os
+import shutil
+import subprocess
+import pytest
+from thingspector import builder
+from thingspector import utils
+from thingspector.builder import Build, ObjectStore, read_depfile
+
+
+def write(tmp_path, text):
+    depfile = tmp_path / "test.d"
+    depfile.write_text(text)
+    return utils.Path(str(depfile))
+
+
+def test_read_depfile(tmp_path):
+    depfile = write(tmp_path, "build/test.o: src/test.c include/a.h \\\n  include/b.h \\\n include/c.h\n")
+
+    assert read_depfile(depfile) == [utils.Path(p) for p in ("src/test.c", "include/a.h", "include/b.h",
+                                                             "include/c.h")]
+
+
+def test_read_depfile_escaped_spaces(tmp_path):
+    depfile = write(tmp_path, "test.o: my\\ dir/test.c inc/x.h\n")
+
+    assert read_depfile(depfile) == [utils.Path("my dir/test.c"), utils.Path("inc/x.h")]
+
+
+def test_read_depfile_first_rule_only(tmp_path):
+    # -MP adds phony targets for the headers
+    depfile = write(tmp_path, "test.o: test.c a.h\n\na.h:\n")
+
+    assert read_depfile(depfile) == [utils.Path("test.c"), utils.Path("a.h")]
+
+
+def test_read_depfile_missing_or_incomplete(tmp_path):
+    assert read_depfile(utils.Path(str(tmp_path / "missing.d"))) is None
+    assert read_depfile(write(tmp_path, "test.o")) is None
+
+
+def test_object_store(tmp_path):
+    store = ObjectStore(utils.Path(str(tmp_path / "objects")))
+    objfile = tmp_path / "tmp.o"
+    objfile.write_bytes(b"object")
+    deps = [utils.Path(str(tmp_path / "a.h")), utils.Path(str(tmp_path / "b.h"))]
+
+    assert not store.has_object("ab12") and store.get_deps("cd34") is None
+    stored = store.put("ab12", utils.Path(str(objfile)), "cd34", deps)
+
+    assert store.has_object("ab12") and store.get_object("ab12") == stored
+    assert stored.is_file() and not objfile.exists()
+    assert store.get_deps("cd34") == deps
+
+    # A broken manifest is as good as none
+    manifest = tmp_path / "objects" / "cd" / "cd34.deps"
+    manifest.write_text("[")
+    assert store.get_deps("cd34") is None
+
+
+@pytest.fixture
+def compiler(monkeypatch, tmp_path):
+    if shutil.which("gcc") is None:
+        pytest.skip("No gcc")
+    monkeypatch.setattr(builder, "COMPILER_CACHE", utils.Path(str(tmp_path / "compilers.json")))
+    compiler = builder.get_compiler("gcc")
+
+    # Counts the compiles
+    compiler.compiled = []
+    compile = compiler.compile
+
+    def counting_compile(srcfile, *args, **kwargs):
+        compiler.compiled.append(os.path.basename(str(srcfile)))
+        return compile(srcfile, *args, **kwargs)
+
+    compiler.compile = counting_compile
+    return compiler
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "work").mkdir()
+    (tmp_path / "src" / "value.h").write_text("#define VALUE 1\n")
+    (tmp_path / "src" / "main.c").write_text('#include "value.h"\nint main(void) { return VALUE; }\n')
+    return tmp_path
+
+
+def build(project, compiler, name):
+    b = Build(utils.Path(str(project / ("test_" + name))), utils.Path(str(project / "work")), compiler)
+    b.add_inc_path(utils.Path(str(project / "src")))
+    b.add_src(utils.Path(str(project / "src" / "main.c")))
+    b.compile_all()
+    assert b.binfile.is_file()
+    return b
+
+
+def test_builds_share_objects(project, compiler):
+    build(project, compiler, "one")
+    build(project, compiler, "two")
+
+    # The second build found the object of the first one in the store
+    assert compiler.compiled == ["main.c"]
+
+
+def test_header_change_invalidates_shared_object(project, compiler):
+    first = build(project, compiler, "one")
+    (project / "src" / "value.h").write_text("#define VALUE 2 /* changed */\n")
+
+    # A new build knows the dependencies only from the manifest of the first one
+    second = build(project, compiler, "two")
+    assert compiler.compiled == ["main.c", "main.c"]
+    assert subprocess.run([second.binfile.abs_str()]).returncode == 2
+    assert str(project / "src" / "value.h") in first.dependencies()
+
+    build(project, compiler, "three")
+    assert compiler.compiled == ["main.c", "main.c"]
+
+
+def test_relink_replaced_binary(project, compiler):
+    (project / "src" / "value.h").write_text("#ifndef VALUE\n#define VALUE 1\n#endif\n")
+    builds = []
+    for value in (3, 4):
+        # Builds of the same binary with other options, like the sessions of a daemon
+        b = Build(utils.Path(str(project / "test_one")), utils.Path(str(project / "work")), compiler)
+        b.add_inc_path(utils.Path(str(project / "src")))
+        b.add_symbol("VALUE", str(value))
+        b.add_src(utils.Path(str(project / "src" / "main.c")))
+        b.compile_all()
+        builds.append(b)
+    assert subprocess.run([builds[0].binfile.abs_str()]).returncode == 4
+
+    builds[0].compile_all()
+    assert subprocess.run([builds[0].binfile.abs_str()]).returncode == 3
+    assert compiler.compiled == ["main.c", "main.c"]
@@ -0,0 +1,8 @@
+import pytest
+from thingspector import changes
+
+
+@pytest.mark.parametrize("rev", ["--output=/tmp/x", "-p"])
+def test_option_like_revision(rev):
+    with pytest.raises(RuntimeError, match="Invalid git revision"):
+        changes.git_changed_files(rev)
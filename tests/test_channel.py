@@ -0,0 +1,99 @@
+import struct
+from thingspector import channel
+
+
+def record(rtype, payload):
+    return struct.pack("<BI", rtype, len(payload)) + payload
+
+
+def test_decode_records():
+    data = record(channel.CASE, struct.pack("<I", 3) + b"add") + \
+        record(channel.ASSERT_BEGIN, struct.pack("<I", 12) + b"test.c") + \
+        record(channel.ASSERT_OK, b"") + \
+        record(channel.ASSERT_BEGIN, struct.pack("<I", 13) + b"test.c") + \
+        record(channel.ASSERT_FAIL, b"Expected 1") + \
+        record(channel.CASE_END, struct.pack("<Q", 1500)) + \
+        record(channel.EXIT, struct.pack("<iQQQ", -11, 2000, 30, 40))
+
+    assert channel.decode(data) == [
+        (channel.CASE, 3, "add"),
+        (channel.ASSERT_BEGIN, "test.c", 12),
+        (channel.ASSERT_OK, ),
+        (channel.ASSERT_BEGIN, "test.c", 13),
+        (channel.ASSERT_FAIL, "Expected 1"),
+        (channel.CASE_END, 1500),
+        (channel.EXIT, -11, 2000, 30, 40),
+    ]
+
+
+def test_decode_stops_at_a_truncated_record():
+    data = record(channel.ASSERT_OK, b"") + record(channel.ASSERT_FAIL, b"cut off")[:-3]
+    assert channel.decode(data) == [(channel.ASSERT_OK, )]
+
+
+def test_decode_reports_unknown_and_short_records():
+    data = record(99, b"") + record(channel.CASE_END, b"\x01")
+    events = channel.decode(data)
+    assert [event[0] for event in events] == [channel.INVALID, channel.INVALID]
+
+
+def test_decode_perf_not_available():
+    na = (1 << 64) - 1
+    data = record(channel.PERF, struct.pack("<QQQ", 100, na, 7))
+    assert channel.decode(data) == [(channel.PERF, 100, None, 7)]
+
+
+def test_parse_text():
+    output = "\n".join([
+        "$$CASE|add",
+        "$$ASSERT_BEGIN|test.c|12",
+        "$$ASSERT_END|OK",
+        "hello",
+        "$$ASSERT_BEGIN|test.c|13",
+        "$$ASSERT_END|Expected a|b",
+        "$$CASE_END|1500",
+        "$$EXIT|1|2|3|4",
+        "$$BOGUS|1",
+    ])
+    assert channel.parse_text(output) == [
+        (channel.CASE, -1, "add"),
+        (channel.ASSERT_BEGIN, "test.c", 12),
+        (channel.ASSERT_OK, ),
+        (channel.CONSOLE, "hello"),
+        (channel.ASSERT_BEGIN, "test.c", 13),
+        (channel.ASSERT_FAIL, "Expected a|b"),
+        (channel.CASE_END, 1500),
+        (channel.EXIT, 1, 2, 3, 4),
+        (channel.INVALID, "$$BOGUS|1"),
+    ]
+
+
+def test_interleave_places_console_output_between_records():
+    events = [(channel.CASE, 0, "a"), (channel.ASSERT_OK, ), (channel.EXIT, 0, 0, 0, 0),
+              (channel.CASE, 1, "b"), (channel.EXIT, 0, 0, 0, 0)]
+    m = channel.MARK
+    output = m + "a before\n" + m + "a after\n" + m + m + "b\n" + m + "tail\n"
+
+    assert channel.interleave(output, events) == [
+        (channel.CASE, 0, "a"),
+        (channel.CONSOLE, "a before"),
+        (channel.ASSERT_OK, ),
+        (channel.CONSOLE, "a after"),
+        (channel.EXIT, 0, 0, 0, 0),
+        (channel.CASE, 1, "b"),
+        (channel.CONSOLE, "b"),
+        (channel.EXIT, 0, 0, 0, 0),
+        (channel.CONSOLE, "tail"),
+    ]
+
+
+def test_interleave_keeps_output_of_lost_records():
+    assert channel.interleave("x\n" + channel.MARK + "y\n", []) == [(channel.CONSOLE, "x"), (channel.CONSOLE, "y")]
+
+
+def test_quiet_summary():
+    data = record(channel.ASSERT_BEGIN, struct.pack("<I", 7) + b"test.c") + \
+        record(channel.ASSERT_FAIL, b"Expected 2") + \
+        record(channel.SUMMARY, struct.pack("<II", 40, 1))
+    assert channel.decode(data)[-1] == (channel.SUMMARY, 40, 1)
+    assert channel.parse_text("$$SUMMARY|40|1") == [(channel.SUMMARY, 40, 1)]
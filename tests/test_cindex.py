@@ -0,0 +1,71 @@
+import pytest
+from thingspector import cindex
+
+
+def names(text):
+    return [f.name for f in cindex._scan(text)]
+
+
+def test_scan_finds_definitions():
+    text = """
+#include "thingspector.h"
+static int counter;
+void test_setup() { counter = 0; }
+static inline int helper(int a) { return a + 1; }
+void case_add(void)
+{
+    struct { int a; } s = { 1 };
+    EXPECT_INT(helper(s.a), 2)
+}
+"""
+    functions = cindex._scan(text)
+    assert [f.name for f in functions] == ["test_setup", "helper", "case_add"]
+    assert functions[1].storage == ["static"]
+    assert functions[1].funcspec == ["inline"]
+    assert functions[2].signature == "void case_add(void)"
+
+
+def test_scan_skips_comments_and_disabled_code():
+    text = """
+/* void case_comment(void) { } */
+// void case_line(void) { }
+#if 0
+void case_disabled(void) { }
+#else
+void case_enabled(void) { }
+#endif
+"""
+    assert names(text) == ["case_enabled"]
+
+
+def test_scan_skips_continued_directives():
+    text = """
+#define SETUP_ALL \\
+void case_ghost(void) { }
+void case_real(void) { }
+"""
+    assert names(text) == ["case_real"]
+
+
+def test_logical_lines_keep_the_line_count():
+    text = "#define A \\\n  1 \\\n  2\nint x;"
+    lines = list(cindex._logical_lines(text))
+    assert lines == ["#define A   1   2", "", "", "int x;"]
+
+
+@pytest.mark.parametrize("text", [
+    "#ifdef FOO\nvoid case_a(void) { }\n#endif\n",
+    "#define CASE(n) void case_##n(void)\nCASE(a) { }\n",
+    "void case_a(void) { }\n}\n",
+    "#if 0\n",
+])
+def test_scan_gives_up_on_ambiguous_files(text):
+    with pytest.raises(cindex._Ambiguous):
+        cindex._scan(text)
+
+
+def test_scan_file_falls_back_on_ambiguous(tmp_path):
+    from thingspector.utils import Path
+    srcfile = tmp_path / "test.c"
+    srcfile.write_text("#ifdef FOO\nvoid case_a(void) { }\n#endif\n")
+    assert cindex.scan_file(Path(str(srcfile))) is None
@@ -0,0 +1,91 @@
+import json
+import re
+import threading
+import pytest
+from thingspector import profiler
+
+
+@pytest.fixture(autouse=True)
+def clean_profiler(monkeypatch):
+    monkeypatch.setattr(profiler, "_enabled", False)
+    monkeypatch.setattr(profiler, "_events", [])
+    monkeypatch.setattr(profiler, "_module", None)
+
+
+def test_disabled():
+    profiler.record("compile", 1.0, 2.0)
+    with profiler.phase("link"):
+        pass
+
+    assert profiler.take_events() == []
+
+
+def test_phase():
+    profiler.enable()
+    with pytest.raises(KeyError):
+        with profiler.phase("parse", "test.c"):
+            raise KeyError()
+
+    events = profiler.take_events()
+    assert [(event.phase, event.detail) for event in events] == [("parse", "test.c")]
+    assert events[0].duration >= 0
+    assert profiler.take_events() == []
+
+
+def test_set_module():
+    profiler.enable()
+    profiler.record("config", 0.0, 1.0)
+    profiler.set_module("one")
+    profiler.record("compile", 1.0, 1.0)
+
+    def work(name):
+        profiler.set_module(name, per_thread=True)
+        profiler.record("run", 2.0, 1.0)
+
+    threads = [threading.Thread(target=work, args=(name, )) for name in ("two", "three")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The threads left the module of the process alone
+    profiler.record("link", 3.0, 1.0)
+
+    assert sorted((event.phase, event.module) for event in profiler.take_events()) == [
+        ("compile", "one"), ("config", None), ("link", "one"), ("run", "three"), ("run", "two")]
+
+
+def test_log_breakdown(capsys):
+    profiler.enable()
+    profiler.set_module("one")
+    profiler.record("compile", 0.0, 0.5)
+    profiler.record("compile", 0.5, 0.25)
+    profiler.set_module("two")
+    profiler.record("run", 1.0, 1.0)
+
+    profiler.log_breakdown()
+
+    rows = dict((fields[0], fields[1:]) for fields in
+                (re.sub(r"\x1b\[[0-9;]*m", "", line).split()[1:] for line in capsys.readouterr().out.splitlines())
+                if len(fields) > 1)
+    assert rows["compile"] == ["750.0", "2", "500.0"]
+    assert rows["run"] == ["1000.0", "1", "1000.0"]
+    assert rows["one"] == ["750.0"] and rows["two"] == ["1000.0"]
+
+
+def test_write_trace(tmp_path):
+    profiler.enable()
+    profiler.set_module("one")
+    profiler.record("compile", 10.0, 0.5, "main.c")
+    profiler.record("link", 10.5, 0.25)
+    path = tmp_path / "trace.json"
+
+    profiler.write_trace(path)
+
+    trace = json.loads(path.read_text())
+    compile_event, link_event = trace["traceEvents"]
+    assert compile_event["ph"] == "X" and link_event["ph"] == "X"
+    assert (compile_event["ts"], compile_event["dur"]) == (0, 500000)
+    assert (link_event["ts"], link_event["dur"]) == (500000, 250000)
+    assert compile_event["name"] == "compile main.c" and compile_event["cat"] == "compile"
+    assert compile_event["args"] == {"module": "one", "detail": "main.c"}
+    assert link_event["args"] == {"module": "one"}
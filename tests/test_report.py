@@ -0,0 +1,66 @@
+import json
+import pytest
+from thingspector import report
+from thingspector import runner
+
+
+def make_result():
+    result = runner.TestResult("mymodule")
+    result.heap = [0, 0, 0, 0]
+
+    passed = runner.CaseResult(0, "add")
+    passed.assert_count = 2
+    passed.duration = 1500
+    passed.wall, passed.user, passed.sys = 0.01, 0.005, 0.001
+    passed.counters = {"instructions": 1000}
+    passed.heap = [3, 96, 64, 0]
+    result.add_case(passed)
+
+    failed = runner.CaseResult(1, "sub")
+    failed.assert_count = 1
+    failed.assert_failed = 1
+    failed.fatal = True
+    failed.timeout = True
+    failed.returncode = -9
+    failed.heap = [1, 16, 16, 16]
+    result.add_case(failed)
+
+    result.cases = 2
+    result.benches.append(runner.BenchResult("loop", 100, 5, 1000, 2000, 3000))
+    return result
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "report.json"
+    broken = runner.TestResult("broken")
+    broken.error = "Build failed"
+    report.write_report(path, [make_result(), broken])
+
+    results = report.read_report(path)
+
+    assert [result.to_dict() for result in results] == [make_result().to_dict(), broken.to_dict()]
+    cases = results[0].case_results
+    assert [case.name for case in cases] == ["add", "sub"]
+    assert cases[0].passed() and not cases[1].passed()
+    assert cases[0].cpu() == pytest.approx(0.006)
+    assert results[0].heap == [4, 112, 64, 16]
+    assert results[0].benches[0].median == 20
+    assert results[1].failed()
+
+
+def test_unsupported_version(tmp_path):
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps({"version": report.REPORT_VERSION + 1, "modules": []}))
+
+    with pytest.raises(RuntimeError, match="unsupported version"):
+        report.read_report(path)
+
+
+def test_unreadable_report(tmp_path):
+    path = tmp_path / "report.json"
+    path.write_text("{not json")
+
+    with pytest.raises(RuntimeError, match="Unable to read report"):
+        report.read_report(path)
+    with pytest.raises(RuntimeError, match="Unable to read report"):
+        report.read_report(tmp_path / "missing.json")
@@ -0,0 +1,85 @@
+import re
+import shutil
+import pytest
+from thingspector import builder
+from thingspector import profiler
+from thingspector import runner
+from thingspector import utils
+from thingspector.thingconfig import ThingConfig
+
+CONFIG = """
+srcdirs: [src]
+incdirs: [src]
+compiler: gcc
+runner: exec
+
+test alpha:
+  target: alpha.c
+
+test beta:
+  target: beta.c
+"""
+
+SOURCE = """
+#include <unistd.h>
+int %(name)s_value(void) { usleep(20000); return 1; }
+"""
+
+TEST_FILE = """
+#include "thingspector.h"
+int %(name)s_value(void);
+
+void test_setup(void) {}
+void test_teardown(void) {}
+
+void case_%(name)s_first(void) { EXPECT_TRUE(%(name)s_value()) }
+void case_%(name)s_second(void) { EXPECT_TRUE(%(name)s_value()) }
+void case_%(name)s_third(void) { EXPECT_TRUE(%(name)s_value()) }
+"""
+
+MODULES = ("alpha", "beta")
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    if shutil.which("gcc") is None:
+        pytest.skip("No gcc")
+    monkeypatch.setattr(builder, "COMPILER_CACHE", utils.Path(str(tmp_path / "compilers.json")))
+    monkeypatch.setattr(profiler, "_enabled", False)
+    monkeypatch.setattr(profiler, "_events", [])
+    monkeypatch.chdir(tmp_path)
+
+    (tmp_path / "inspect.yaml").write_text(CONFIG)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "inspect" / "tests").mkdir(parents=True)
+    for name in MODULES:
+        (tmp_path / "src" / ("%s.c" % name)).write_text(SOURCE % {"name": name})
+        (tmp_path / "inspect" / "tests" / ("test_%s.c" % name)).write_text(TEST_FILE % {"name": name})
+    return tmp_path
+
+
+def test_modules_side_by_side(project, capsys):
+    profiler.enable()
+    session = runner.Session(ThingConfig, jobs=4)
+    capsys.readouterr()
+
+    results = session.test(session.mf.select_tests([]))
+
+    assert [(result.name, result.cases, result.failed()) for result in results] == [
+        ("alpha", 3, False), ("beta", 3, False)]
+
+    # The output of each module, including that of its compile and case threads, is printed as one block
+    lines = re.sub(r"\x1b\[[0-9;]*m", "", capsys.readouterr().out).splitlines()
+    lines = lines[:next(i for i, line in enumerate(lines) if "Summary" in line)]
+    order = [name for line in lines for name in MODULES if name in line]
+    assert "Compiling" in "\n".join(lines)
+    assert order == sorted(order) and set(order) == set(MODULES)
+
+    # All phases of a module, on whatever thread, are attributed to it
+    events = profiler.take_events()
+    for name in MODULES:
+        mentions = [event for event in events if name in str(event.detail)]
+        assert set(event.phase for event in mentions) >= {"compile", "run"}
+        assert all(event.module == name for event in mentions)
+    assert all(event.phase == "compiler discovery" for event in events if event.module is None)
+    assert len(set(event.tid for event in events if event.phase == "compile")) > 2
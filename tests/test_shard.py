@@ -0,0 +1,112 @@
+import types
+import pytest
+from thingspector import runner
+from thingspector import shard
+from thingspector import utils
+
+TEST_FILE = """
+#include "thingspector.h"
+
+void test_setup(void) {}
+void test_teardown(void) {}
+
+static void helper(void) {}
+
+void case_%s_a(void) { helper(); }
+void case_%s_b(void) {}
+"""
+
+EMPTY_FILE = """
+void test_setup(void) {}
+void test_teardown(void) {}
+"""
+
+
+def make_tests(tmp_path, names):
+    tests = []
+    for name in names:
+        testsrc = tmp_path / ("test_%s.c" % name)
+        testsrc.write_text(TEST_FILE % (name, name) if name != "empty" else EMPTY_FILE)
+        tests.append(types.SimpleNamespace(name=name, testsrc=utils.Path(str(testsrc)), shard_cases=None))
+    return tests
+
+
+def make_result(name, cases):
+    result = runner.TestResult(name)
+    result.heap = [0, 0, 0, 0]
+    for idx, case_name, failed in cases:
+        case = runner.CaseResult(idx, case_name)
+        case.assert_count = 1
+        case.assert_failed = 1 if failed else 0
+        case.heap = [1, 8, 8, 0]
+        result.add_case(case)
+        result.cases += 1
+    return result
+
+
+def test_parse_shard():
+    assert shard.parse_shard("1/3") == (0, 3)
+    assert shard.parse_shard("3/3") == (2, 3)
+
+
+@pytest.mark.parametrize("text", ["0/3", "4/3", "1", "a/b", "-1/2", "1/0"])
+def test_invalid_shard(text):
+    with pytest.raises(RuntimeError):
+        shard.parse_shard(text)
+
+
+def test_partition():
+    units = [(5, "a"), (4, "b"), (3, "c"), (3, "d"), (2, "e"), (1, "f")]
+
+    shards = shard.partition(units, 2)
+
+    assert shards == [["a", "d", "f"], ["b", "c", "e"]]
+    assert shards == shard.partition(list(reversed(units)), 2)
+    assert sorted(sum(shards, [])) == sorted(key for _, key in units)
+    loads = [sum(cost for cost, key in units if key in keys) for keys in shards]
+    assert max(loads) - min(loads) <= 1
+
+
+def test_partition_more_shards_than_units():
+    assert shard.partition([(1, "a")], 3) == [["a"], [], []]
+
+
+def test_select_shard(tmp_path):
+    names = ["one", "two", "empty"]
+    selected = [shard.select_shard(make_tests(tmp_path, names), index, 2) for index in range(2)]
+
+    cases = sorted((test.name, case) for tests in selected for test in tests for case in test.shard_cases)
+    assert cases == [(name, "%s_%s" % (name, part)) for name in ("one", "two") for part in "ab"]
+    # Without cases, the module still goes to the first shard
+    assert [test.name for test in selected[0]].count("empty") == 1
+    assert all(test.name != "empty" for test in selected[1])
+
+
+def test_select_shard_timings(tmp_path):
+    timings = [make_result("one", [(0, "one_a", False), (1, "one_b", False)]),
+               make_result("two", [(0, "two_a", False)])]
+    timings[0].case_results[0].wall = 10.0
+    timings[0].case_results[1].wall = 1.0
+    timings[1].case_results[0].duration = 1e9
+
+    # two_b is new, and weighs the median of the known cases
+    first = shard.select_shard(make_tests(tmp_path, ["one", "two"]), 0, 2, timings)
+
+    # The slow case is alone on its shard
+    assert [(test.name, test.shard_cases) for test in first] == [("one", {"one_a"})]
+
+
+def test_merge():
+    shards = [
+        [make_result("one", [(1, "b", True)]), make_result("empty", [])],
+        [make_result("one", [(0, "a", False)]), make_result("two", [(0, "c", False)])],
+    ]
+
+    results = shard.merge(shards)
+
+    assert [result.name for result in results] == ["one", "empty", "two"]
+    one = results[0]
+    assert [case.name for case in one.case_results] == ["a", "b"]
+    assert (one.cases, one.assert_count, one.assert_failed) == (2, 2, 1)
+    assert one.heap == [2, 16, 8, 0]
+    assert results[1].cases == 0 and not results[1].failed()
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_imports():
+    # Commands which need neither the configuration nor a build should start without importing them
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import thingspector.__main__"],
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = set(line.split("|")[-1].strip() for line in process.stderr.splitlines()
+                  if line.startswith("import time:"))
+
+    assert "thingspector.__main__" in modules
+    for module in ("yaml", "pycparser", "thingspector.builder"):
+        assert module not in modules
@@ -0,0 +1,36 @@
+import pytest
+from thingspector import thingconfig
+
+
+@pytest.mark.parametrize("value, seconds", [
+    (None, None),
+    (5, 5.0),
+    (0.25, 0.25),
+    ("1.5", 1.5),
+])
+def test_seconds(value, seconds):
+    assert thingconfig._seconds(value, "timeout") == seconds
+
+
+@pytest.mark.parametrize("value", [0, -1, "0", "soon", "", [1], "nan", "inf"])
+def test_invalid_seconds(value):
+    with pytest.raises(RuntimeError, match="'timeout'"):
+        thingconfig._seconds(value, "timeout")
+
+
+@pytest.mark.parametrize("value, size", [
+    (None, None),
+    (4096, 4096),
+    ("512", 512),
+    ("64K", 64 << 10),
+    ("256m", 256 << 20),
+    (" 2G ", 2 << 30),
+])
+def test_size(value, size):
+    assert thingconfig._size(value, "memory") == size
+
+
+@pytest.mark.parametrize("value", [0, "0M", "-1", "1.5G", "M", "", "12T", "lots"])
+def test_invalid_size(value):
+    with pytest.raises(RuntimeError, match="'memory'"):
+        thingconfig._size(value, "memory")
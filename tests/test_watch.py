@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+from thingspector import watch
+
+DIRS = [("/home/me/.projects/app", False), ("/home/me/.projects/app/src", True)]
+
+
+@pytest.mark.parametrize("path, ignored", [
+    ("/home/me/.projects/app/src/main.c", False),
+    ("/home/me/.projects/app/src/lib/util.h", False),
+    ("/home/me/.projects/app/inspect.yaml", False),
+    ("/home/me/.projects/app/src/.main.c.swp", True),
+    ("/home/me/.projects/app/src/.git/index", True),
+    ("/home/me/.projects/app/.inspect/build/test.o", True),
+    ("/home/me/.projects/app/src/../src/main.c", False),
+])
+def test_ignored(path, ignored):
+    assert watch._ignored(path, DIRS) == ignored
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_close(tmp_path):
+    watcher = watch.InotifyWatcher([(str(tmp_path), True)])
+    (tmp_path / "main.c").write_text("int x;\n")
+    assert watcher.wait(1) == {str(tmp_path / "main.c")}
+
+    fd = watcher.fd
+    watcher.close()
+    watcher.close()
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_polling_close(tmp_path):
+    watcher = watch.PollingWatcher([(str(tmp_path), True)])
+    watcher.close()
@@ -1,13 +1,229 @@
-from thingspector.thingconfig import ThingConfig
-from thingspector import runner as tr
+from thingspector import profiler
+import os
 import sys
 
+# The configuration, runner and report modules pull in YAML and the build machinery, they are imported by the
+# commands which need them, so i.e. printing the help stays fast.
+
 
 def print_help():
     print("Thingspector - Embedded C test framework")
     print("Usage: ")
     print(" mut u [<module>[ <module> <etc..>]] - Update all or some module test sources")
-    print(" mut t [<module>[ <module> <etc..>]] - Compile (if needed) and test one or more modules")
+    print(" mut t [<options>] [<module>[ <module> <etc..>]] - Compile (if needed) and test one or more modules")
+    print(" mut w [<options>] [<module>[ <module> <etc..>]] - Test, and retest the affected modules on every change")
+    print(" mut m <report.json> <shard report.json>[ <etc..>] - Merge the reports of the shards of a run into one")
+    print(" mut d - Run a daemon which keeps its state between u and t commands, which are handed to it")
+    print("")
+    print("Options:")
+    print(" -j <jobs>    Number of concurrent compilers and test cases (default: number of CPUs)")
+    print(" -q, --quiet  Only report failed assertions, count the passing ones (default: per test in inspect.yaml)")
+    print(" --heap       Track the heap use of each case (default: per test in inspect.yaml)")
+    print(" --changed[=<rev>]  Only test the modules affected by the changes since a git revision (default: HEAD)")
+    print(" --changed-files=<file>[,<file>..]  Only test the modules affected by the given changed files")
+    print(" --no-cache   Run all cases, also those which passed before with the same test binary and inputs")
+    print(" --bench      Run the BENCH_<name> benchmarks after the tests, one at a time")
+    print(" --report <file.json>  Write the results, including timings and counters per case, as JSON")
+    print(" --shard <i>/<N>  Only run the i-th of N disjoint parts of the (module, case) pairs, i.e. one per CI node")
+    print(" --timings <report.json>  Balance the shards by the case durations in the report of an earlier run")
+    print(" --no-daemon  Run the command in this process, also when a daemon is running")
+    print(" --profile[=<trace.json>]  Show where Thingspector spends its time, optionally as a Chrome trace file")
+
+def parse_args(args):
+    """
+        Splits the arguments following the command in options and module names.
+    """
+    options = {
+        "jobs": os.cpu_count() or 1,
+        "quiet": False,
+        "bench": False,
+        "heap": False,
+        "cache": True,
+        "changed": None,
+        "changed_files": None,
+        "report": None,
+        "profile": False,
+        "trace": None,
+        "daemon": True,
+        "shard": None,
+        "timings": None
+    }
+    modules = []
+
+    args = iter(args)
+    for arg in args:
+        if arg.startswith("-j"):
+            value = arg[2:] if len(arg) > 2 else next(args, None)
+            if value is None or not value.isdigit() or int(value) < 1:
+                raise RuntimeError("Option -j expects a positive number of jobs")
+            options["jobs"] = int(value)
+        elif arg in ("-q", "--quiet"):
+            options["quiet"] = True
+        elif arg == "--bench":
+            options["bench"] = True
+        elif arg == "--heap":
+            options["heap"] = True
+        elif arg == "--changed" or arg.startswith("--changed="):
+            options["changed"] = arg[len("--changed="):] or "HEAD"
+        elif arg.startswith("--changed-files="):
+            options["changed_files"] = [f for f in arg[len("--changed-files="):].split(",") if len(f) > 0]
+        elif arg == "--no-cache":
+            options["cache"] = False
+        elif arg == "--report" or arg.startswith("--report="):
+            value = arg[len("--report="):] if "=" in arg else next(args, None)
+            if not value:
+                raise RuntimeError("Option --report expects a file name")
+            options["report"] = value
+        elif arg == "--profile" or arg.startswith("--profile="):
+            options["profile"] = True
+            options["trace"] = arg[len("--profile="):] or None
+        elif arg == "--shard" or arg.startswith("--shard="):
+            value = arg[len("--shard="):] if "=" in arg else next(args, None)
+            if not value:
+                raise RuntimeError("Option --shard expects a shard as i/N")
+            options["shard"] = value
+        elif arg == "--timings" or arg.startswith("--timings="):
+            value = arg[len("--timings="):] if "=" in arg else next(args, None)
+            if not value:
+                raise RuntimeError("Option --timings expects a report file")
+            options["timings"] = value
+        elif arg == "--no-daemon":
+            options["daemon"] = False
+        elif arg.startswith("-"):
+            raise RuntimeError("Unknown option '%s'" % arg)
+        else:
+            modules.append(arg)
+
+    return options, modules
+
+
+def load_config(options):
+    """
+        Loads inspect.yaml, with the options of the command line applied to its tests.
+    """
+    from thingspector.thingconfig import ThingConfig
+
+    with profiler.phase("config load"):
+        mf = ThingConfig()
+
+    for test in mf.tests.values():
+        test.quiet = test.quiet or options["quiet"]
+        test.heap = test.heap or options["heap"]
+        test.result_cache = options["cache"]
+    return mf
+
+
+def select_changed(mf, tests, options, builds=None):
+    """
+        Narrows the tests down to those affected by the changed files.
+    """
+    from thingspector import changes
+    from thingspector.utils import log
+
+    changed = list(options["changed_files"] or [])
+    if options["changed"] is not None:
+        changed += changes.git_changed_files(options["changed"])
+
+    affected = changes.affected_tests(tests, changed, mf.filename, builds)
+    log.info("%(affected)d of %(tests)d tests affected by %(changed)d changed files", affected=len(affected),
+             tests=len(tests), changed=len(changed))
+    return affected
+
+
+def update(mf, modules):
+    """
+        The u command.
+        :return: Exit code
+    """
+    from thingspector import runner as tr
+
+    for mock in mf.mocks.values():
+        tr.update_mock(mock)
+
+    for test in mf.select_tests(modules):
+        tr.update_test(test)
+    return 0
+
+
+def test(mf, options, modules, session=None):
+    """
+        The t command. Modules are tested on a process pool, or by the session of a daemon when given.
+        :return: Exit code
+    """
+    from thingspector import runner as tr
+
+    builds = None if session is None else dict((name, t.builder) for name, t in session.testers.items())
+    tests = mf.select_tests(modules)
+    if options["changed"] is not None or options["changed_files"] is not None:
+        tests = select_changed(mf, tests, options, builds)
+    # Left over from an earlier request to the daemon
+    for t in tests:
+        t.shard_cases = None
+    if options["shard"] is not None:
+        from thingspector import report
+        from thingspector import shard
+        index, count = shard.parse_shard(options["shard"])
+        timings = report.read_report(options["timings"]) if options["timings"] is not None else None
+        tests = shard.select_shard(tests, index, count, timings)
+
+    if session is None:
+        # Resolve the configured compiler once, before the config is handed to the workers
+        mf.get_compiler()
+        results = tr.execute_tests(tests, jobs=options["jobs"], bench=options["bench"])
+    else:
+        session.jobs = options["jobs"]
+        results = session.test(tests, bench=options["bench"])
+
+    if options["report"] is not None:
+        from thingspector import report
+        report.write_report(options["report"], results)
+
+    return 1 if any(result.failed() for result in results) else 0
+
+
+def merge(paths):
+    """
+        The m command: merges the reports of the shards of a run.
+        :return: Exit code
+    """
+    from thingspector import report
+    from thingspector import runner as tr
+    from thingspector import shard
+
+    if len(paths) < 2:
+        raise RuntimeError("Expected the merged report, followed by the reports of the shards")
+
+    results = shard.merge([report.read_report(path) for path in paths[1:]])
+    report.write_report(paths[0], results)
+    tr.log_summary(results)
+    return 1 if any(result.failed() for result in results) else 0
+
+
+def serve():
+    """
+        The d command: runs the daemon. It keeps a session per combination of options which change the builds or
+        the results, and drops them all when inspect.yaml changes.
+    """
+    from thingspector import daemon
+    from thingspector import runner as tr
+
+    sessions = {}
+
+    def handle(args):
+        options, modules = parse_args(args[1:])
+        if any(session.is_stale() for session in sessions.values()):
+            sessions.clear()
+
+        key = (options["quiet"], options["heap"], options["cache"])
+        if key not in sessions:
+            sessions[key] = tr.Session(lambda: load_config(options), options["jobs"])
+        session = sessions[key]
+
+        if args[0] == 'u':
+            return update(session.mf, modules)
+        return test(session.mf, options, modules, session)
+
+    daemon.serve(handle)
 
 
 if __name__ == "__main__":
@@ -17,21 +233,38 @@ if __name__ == "__main__":
         sys.exit(0)
 
     try:
-        if sys.argv[1] == 'u':
-            mf = ThingConfig()
+        options, modules = parse_args(sys.argv[2:])
+        if options["profile"]:
+            profiler.enable()
+
+        # Hand the command to the daemon when one is running, profiling is about this process though
+        if sys.argv[1] in ('u', 't') and options["daemon"] and not options["profile"]:
+            from thingspector import daemon
+            code = daemon.request(sys.argv[1:])
+            if code is not None:
+                sys.exit(code)
 
-            for mock in mf.mocks.values():
-                tr.update_mock(mock)
+        try:
+            if sys.argv[1] == 'u':
+                sys.exit(update(load_config(options), modules))
 
-            for test in mf.tests.values():
-                tr.update_test(test)
+            elif sys.argv[1] == 't':
+                sys.exit(test(load_config(options), options, modules))
 
-        elif sys.argv[1] == 't':
-            mf = ThingConfig()
+            elif sys.argv[1] == 'm':
+                sys.exit(merge(modules))
 
-            for test in mf.tests.values():
+            elif sys.argv[1] == 'w':
+                from thingspector import watch
+                watch.watch(lambda: load_config(options), modules, jobs=options["jobs"])
 
-                tr.execute_test(test)
+            elif sys.argv[1] == 'd':
+                serve()
+        finally:
+            if options["profile"]:
+                profiler.log_breakdown()
+                if options["trace"] is not None:
+                    profiler.write_trace(options["trace"])
     except RuntimeError as e:
         print("Error: %s" % e)
         sys.exit(1)
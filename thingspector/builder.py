@@ -1,18 +1,14 @@
 import os
 from thingspector import utils
+from thingspector import cindex
+from thingspector import profiler
 from thingspector.utils import log
 from thingspector.utils import Path
 from thingspector.utils import log
-import yaml
+import json
+import shutil
 import uuid
 
-import pycparser as cp
-try:
-    import pycparserext.ext_c_parser as ecp
-    PARSER = ecp.GnuCParser
-except _:
-    PARSER = cp.CParser
-
 
 IS_WINDOWS = os.name == 'nt'
 
@@ -20,6 +16,14 @@ EXEC_EXTENSION = ".exe" if IS_WINDOWS else ""
 INCLUDE_ROOT = Path(os.path.dirname(__file__), "includes")
 INCLUDE_FAKE_LIB_C = INCLUDE_ROOT + "fake_libc"
 INCLUDE_TS = INCLUDE_ROOT + "thingspector"
+# Runtime linked into every test runner
+RUNTIME_SRC = INCLUDE_TS + "thingspector.c"
+# Heap instrumentation, linked in with HEAP_LINK_FLAGS and HEAP_SYMBOL defined
+HEAP_SRC = INCLUDE_TS + "heap.c"
+HEAP_SYMBOL = "THINGSPECTOR_HEAP"
+HEAP_LINK_FLAGS = ["-Wl,--wrap=malloc,--wrap=calloc,--wrap=realloc,--wrap=free"]
+# Bump when the contents of the build cache files change, so older ones are no longer used
+BUILD_CACHE_VERSION = 2
 
 class Compiler:
     """
@@ -44,6 +48,13 @@ class Compiler:
     def compile_all(self, outfile, *srcfiles, includepaths=None):
         raise NotImplemented()
 
+    def fingerprint(self, flags=[], include_path=[], symbols={}):
+        """
+        Fingerprint of a compiler invocation, without its input and output files. Equal fingerprints mean equal
+        output for equal input.
+        """
+        raise NotImplemented()
+
     def __str__(self):
         return "%s %s (%s)" % (self.get_type(), self.version, self.executable)
 
@@ -116,61 +127,266 @@ class GccCompiler(Compiler):
         # print("Executing: " + " ".join(path_items))
         return path_items
 
-    def compile(self, srcfile, outfile, include_path=[], symbols={}):
+    @staticmethod
+    def __depfile_flags(depfile):
+        # Let the compiler write the (non-system) header dependencies while it is at it
+        return ["-MMD", "-MF", depfile.abs_str()] if depfile is not None else []
+
+    def fingerprint(self, flags=[], include_path=[], symbols={}):
+        return utils.digest_strings(self.get_type(), self.version,
+                                    *self.__make_path_items(flags, include_path=include_path, symbols=symbols))
+
+    def compile(self, srcfile, outfile, include_path=[], symbols={}, depfile=None):
         log.verbose("Compiling %(outfile)s from %(srcfile)s", outfile=outfile, srcfile=srcfile)
-        path_items = self.__make_path_items(["-c"], [srcfile], outfile, include_path, symbols)
+        path_items = self.__make_path_items(["-c"] + self.__depfile_flags(depfile), [srcfile], outfile, include_path,
+                                            symbols)
         output, _ = utils.exec2str(*path_items)
 
-    def link(self, binfile, *objfiles):
+    def link(self, binfile, *objfiles, flags=[]):
         log.verbose("Linking %(binfile)s from %(objfiles)s", binfile=binfile, objfiles=", ".join(str(x) for x in objfiles))
-        path_items = self.__make_path_items(infiles=objfiles, outfile=binfile)
+        path_items = self.__make_path_items(flags=flags, infiles=objfiles, outfile=binfile)
         output, _ = utils.exec2str(*path_items)
 
-    def dependencies(self, srcfile, include_path=[], symbols={}):
-        log.verbose("Dependencies for %(srcfile)s", srcfile=srcfile)
+    def preprocess(self, srcfile, outfile, include_path=[], symbols={}, depfile=None):
+        log.verbose("Preprocessing for %(srcfile)s", srcfile=srcfile)
+        path_items = self.__make_path_items(["-E"] + self.__depfile_flags(depfile), [srcfile], outfile, include_path,
+                                            symbols)
+        output, _ = utils.exec2str(*path_items)
 
-        path_items = self.__make_path_items(flags=['-E', '-Wp,-MM'], infiles=[srcfile], include_path=include_path, symbols=symbols)
 
-        output, _ = utils.exec2str(*path_items)
-        deps = " ".join([l[0:-1].strip() if l.endswith("\\") else l.strip() for l in output.split("\n")[1:]]).split()
-        deps = [Path(dep) for dep in deps]
-        return deps
+def read_depfile(depfile):
+    """
+        Reads the dependencies from a make-style dependency file, as written by the compiler.
+        :return: List of dependencies, or None when there is no (complete) dependency file.
+    """
+    if not depfile.is_file():
+        return None
 
-    def preprocess(self, srcfile, outfile, include_path=[], symbols={}):
-        log.verbose("Preprocessing for %(srcfile)s", srcfile=srcfile)
-        path_items = self.__make_path_items(["-E"], [srcfile], outfile, include_path, symbols)
-        output, _ = utils.exec2str(*path_items)
+    with depfile.open("r") as stream:
+        rule = stream.read().replace("\\\n", " ").split("\n")[0]
+
+    i = rule.find(": ")
+    if i < 0:
+        return None
+
+    # Spaces in file names are escaped
+    deps = rule[i + 2:].replace("\\ ", "\0").split()
+    return [Path(dep.replace("\0", " ")) for dep in deps]
 
 
 COMPILER_DISCOVERY = [
     GccCompiler.check_create
 ]
 
+# Compiler classes by their type, to restore them from the compiler cache
+COMPILER_TYPES = {
+    "GCC": GccCompiler
+}
+
+COMPILER_CACHE = utils.CACHE_ROOT + "compilers.json"
+
+
+def _load_compiler_cache():
+    if not COMPILER_CACHE.is_file():
+        return None
+
+    try:
+        with COMPILER_CACHE.open("r") as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_compiler_cache(cache):
+    try:
+        utils.write_atomic(COMPILER_CACHE, json.dumps(cache, indent=1))
+    except OSError as e:
+        log.trace("Unable to write compiler cache: %(error)s", error=e)
+
+
+def _check_create(path, cached):
+    """
+        Creates the compiler for the executable at path, if it is one. Compilers found before (with the same
+        modification time) are restored from cache, all others are checked by the COMPILER_DISCOVERY functions.
+    """
+    mtime = os.path.getmtime(path)
+    entry = cached.get(path)
+    if entry is not None and entry["mtime"] == mtime and entry["type"] in COMPILER_TYPES:
+        return COMPILER_TYPES[entry["type"]](path, entry["version"])
+
+    for c in COMPILER_DISCOVERY:
+        e = c(path)
+        if e is not None:
+            return e
+
+    return None
+
+
+def _to_cache_entry(compiler):
+    return {
+        "executable": compiler.executable,
+        "mtime": os.path.getmtime(compiler.executable),
+        "type": compiler.get_type(),
+        "version": compiler.version
+    }
+
 
 def find_compilers():
     """
         Finds compilers on path.
+
+        The result is cached on disk, keyed by PATH, the modification times of its directories and of the found
+        executables. As long as none of them changed, nothing is listed or executed.
     """
+    search_path = os.environ.get('PATH', '')
+    dirs = [p for p in search_path.split(os.pathsep) if len(p.strip()) > 0 and os.path.isdir(p)]
+
+    cache = _load_compiler_cache()
+    cached = {}
+
+    if cache is not None:
+        try:
+            cached = dict((entry["executable"], entry) for entry in cache["compilers"])
+            if cache["path"] == search_path and \
+                    all(cache["dirs"].get(p) == os.path.getmtime(p) for p in dirs) and \
+                    all(os.path.isfile(exe) and os.path.getmtime(exe) == entry["mtime"] for exe, entry in cached.items()):
+                log.trace("Using cached compilers from %(cache)s", cache=COMPILER_CACHE)
+                return [COMPILER_TYPES[entry["type"]](entry["executable"], entry["version"])
+                        for entry in cache["compilers"]]
+        except (KeyError, TypeError, OSError):
+            cached = {}
 
     found_compilers = []
 
-    for p in os.environ['PATH'].split(os.pathsep):
-        if len(p.strip()) == 0:
-            continue
+    for p in dirs:
         for f in os.listdir(p):
             fp = os.path.join(p, f)
+            if not os.path.isfile(fp):
+                continue
 
-            for c in COMPILER_DISCOVERY:
-                e = c(fp)
-                if e is not None:
-                    found_compilers.append(e)
+            e = _check_create(fp, cached)
+            if e is not None:
+                found_compilers.append(e)
+
+    _save_compiler_cache({
+        "path": search_path,
+        "dirs": dict((p, os.path.getmtime(p)) for p in dirs),
+        "compilers": [_to_cache_entry(c) for c in found_compilers]
+    })
 
     return found_compilers
 
-FOUND_COMPILERS = find_compilers()
 
+_found_compilers = None
+
+
+def get_compilers():
+    """
+        Returns the compilers on path, discovering them on first use.
+    """
+    global _found_compilers
+    if _found_compilers is None:
+        with profiler.phase("compiler discovery"):
+            _found_compilers = find_compilers()
+    return _found_compilers
+
+
+def get_compiler(name):
+    """
+        Returns the compiler for an executable name or path (as configured in inspect.yaml), without searching the
+        whole PATH.
+    """
+    path = name if os.path.dirname(name) else shutil.which(name)
+    if path is None or not os.path.isfile(path):
+        raise RuntimeError("Compiler '%s' not found" % name)
+
+    with profiler.phase("compiler discovery", name):
+        cache = _load_compiler_cache() or {}
+        cached = dict((entry["executable"], entry) for entry in cache.get("compilers", []))
+
+        compiler = _check_create(os.path.abspath(path), cached)
+    if compiler is None:
+        raise RuntimeError("'%s' is not a supported compiler" % name)
+    return compiler
+
+
+def read_dependencies(binfile):
+    """
+        Reads the files a binary was built from, as recorded in its build cache: the sources and their (header)
+        dependencies, without loading the whole build.
+        :return: Set of absolute paths, or None when the dependencies are not (all) known
+    """
+    cachefile = binfile.extend(".cache")
+    try:
+        with cachefile.open("r") as stream:
+            cache = json.load(stream)
+        if cache.get("version") != BUILD_CACHE_VERSION:
+            return None
+
+        return _dependency_files(cache["deps"], cache["ppdeps"])
+    except (OSError, ValueError, KeyError, AttributeError, TypeError):
+        return None
 
 
+def _dependency_files(src2deps, src2ppdeps):
+    files = set()
+    for src, deps in src2deps.items():
+        # Not (successfully) compiled yet
+        if deps is None:
+            return None
+        files.add(os.path.abspath(str(src)))
+        files.update(os.path.abspath(str(dep)) for dep in deps)
+    # Preprocessing (for indexing) sees the fake libc headers instead, and is not done for every source
+    for src, deps in src2ppdeps.items():
+        files.update(os.path.abspath(str(dep)) for dep in deps or [])
+    return files if len(files) > 0 else None
+
+
+class ObjectStore:
+    """
+        Content addressed store of object files, shared by all builds in a work directory. Objects are stored by their
+        fingerprint (command, source and dependency contents), so builds which compile the same source with the same
+        command share a single compile.
+
+        Next to the objects it keeps a manifest per (command, source path, source contents) with the dependencies
+        of the last compile, so a build which never compiled the source itself can still calculate the fingerprint.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __get_file(self, digest, ext):
+        return self.root + (digest[:2], "%s.%s" % (digest, ext))
+
+    def has_object(self, fp):
+        return self.__get_file(fp, "o").is_file()
+
+    def get_object(self, fp):
+        return self.__get_file(fp, "o")
+
+    def get_deps(self, key):
+        manifest = self.__get_file(key, "deps")
+        if not manifest.is_file():
+            return None
+
+        try:
+            with manifest.open("r") as stream:
+                return [Path(dep) for dep in json.load(stream)]
+        except (OSError, ValueError):
+            return None
+
+    def put(self, fp, objfile, key, deps):
+        """
+        Moves a freshly compiled object file into the store.
+        :return: The stored object file
+        """
+        stored = self.__get_file(fp, "o")
+        os.makedirs(os.path.dirname(stored.abs_str()), exist_ok=True)
+        # Rename is atomic, concurrent builds publishing the same object just replace it by an equal one
+        os.replace(objfile.abs_str(), stored.abs_str())
+        utils.write_atomic(self.__get_file(key, "deps"), json.dumps([dep.abs_str() for dep in deps]))
+        return stored
+
 
 class Build:
     """
@@ -182,22 +398,40 @@ class Build:
         self.cachefile = binfile.extend(".cache")
         self.srcfiles = set()
         self.workdir = workdir
+        self.store = ObjectStore(workdir + "objects")
+        self.index_cache = cindex.IndexCache(workdir + "index")
 
         if compiler is None:
-            if len(FOUND_COMPILERS) == 0:
+            compilers = get_compilers()
+            if len(compilers) == 0:
                 raise RuntimeError("No compiler!")
-            compiler = FOUND_COMPILERS[0]
+            compiler = compilers[0]
 
         self.compiler = compiler
 
         self.src2id = {}
+        # Dependencies of the object files, and of the (fake libc) preprocessed files
         self.src2deps = {}
+        self.src2ppdeps = {}
+        # Fingerprints (command line plus contents of source and dependencies) of the current object files, the
+        # preprocessed files and the linked binary
+        self.src2fp = {}
+        self.src2ppfp = {}
+        self.link_fp = None
+        # Content digest of the binary as linked, another build (i.e. with other options) may have replaced it since
+        self.bin_digest = None
+        # Content digests by absolute path, as [mtime, size, digest]
+        self.digests = {}
         self.symbols = {}
-        self.incpath = set()
+        # Kept in order, as it is the include search order
+        self.incpath = []
+        self.link_flags = []
         self.__load_cache()
 
     def add_inc_path(self, *incpath):
-        self.incpath.update(incpath)
+        for p in incpath:
+            if p not in self.incpath:
+                self.incpath.append(p)
 
     def add_symbol(self, name, value=None):
         self.symbols[name] = value
@@ -205,6 +439,18 @@ class Build:
     def add_symbols(self, **kwargs):
         self.symbols.update(kwargs)
 
+    def dependencies(self):
+        """
+        The files this build depends on, as far as known: the sources and their (header) dependencies.
+        :return: Set of absolute paths, or None when the dependencies are not (all) known
+        """
+        return _dependency_files(self.src2deps, self.src2ppdeps)
+
+    def add_link_flags(self, *flags):
+        for flag in flags:
+            if flag not in self.link_flags:
+                self.link_flags.append(flag)
+
     def add_src(self, *srcfiles):
 
         for srcfile in srcfiles:
@@ -214,54 +460,142 @@ class Build:
             if srcfile not in self.src2id:
                 self.src2id[srcfile] = uuid.uuid4().hex
                 self.src2deps[srcfile] = None
+                self.src2ppdeps[srcfile] = None
 
-        self.__save_cache()
+    def save(self):
+        """
+        Writes the build cache, if anything changed since it was loaded or last saved. The file is replaced
+        atomically, so an interrupted build can never leave a corrupt cache behind.
+        """
+        def paths(deps):
+            return None if deps is None else [str(dep) for dep in deps]
 
-    def __save_cache(self):
         cache = {
-            "ids": self.src2id,
-            "deps": self.src2deps
+            "version": BUILD_CACHE_VERSION,
+            "ids": dict((str(src), uid) for src, uid in self.src2id.items()),
+            "deps": dict((str(src), paths(deps)) for src, deps in self.src2deps.items()),
+            "ppdeps": dict((str(src), paths(deps)) for src, deps in self.src2ppdeps.items()),
+            "fps": dict((str(src), fp) for src, fp in self.src2fp.items()),
+            "ppfps": dict((str(src), fp) for src, fp in self.src2ppfp.items()),
+            "link": self.link_fp,
+            "bin": self.bin_digest,
+            "digests": self.digests
         }
 
-        with self.cachefile.open("w") as stream:
-            yaml.dump(cache, stream, default_flow_style=False)
+        data = json.dumps(cache, separators=(",", ":"))
+        if data == self.__saved:
+            return
 
+        utils.write_atomic(self.cachefile, data)
+        self.__saved = data
 
     def __load_cache(self):
+        self.__saved = None
+
         if not self.cachefile.is_file():
             return
 
-        with self.cachefile.open("r") as stream:
-            cache = yaml.load(stream)
+        try:
+            with self.cachefile.open("r") as stream:
+                cache = json.load(stream)
+            if cache.get("version") != BUILD_CACHE_VERSION:
+                raise ValueError("version %s" % cache.get("version"))
+        except (OSError, ValueError) as e:
+            # Written by an older version, everything will just be rebuilt
+            log.trace("Ignoring build cache %(file)s: %(error)s", file=self.cachefile, error=e)
+            return
 
-        self.src2id = cache['ids']
-        self.src2deps = cache['deps']
+        def paths(deps):
+            return None if deps is None else [Path(dep) for dep in deps]
+
+        self.src2id = dict((Path(src), uid) for src, uid in cache['ids'].items())
+        self.src2deps = dict((Path(src), paths(deps)) for src, deps in cache['deps'].items())
+        self.src2ppdeps = dict((Path(src), paths(deps)) for src, deps in cache['ppdeps'].items())
+        self.src2fp = dict((Path(src), fp) for src, fp in cache['fps'].items())
+        self.src2ppfp = dict((Path(src), fp) for src, fp in cache['ppfps'].items())
+        self.link_fp = cache['link']
+        self.bin_digest = cache['bin']
+        self.digests = cache['digests']
 
     def __get_tmp_file(self, srcfile, ext):
         uid = self.src2id[srcfile]
         return self.workdir + ("%s.%s" % (uid, ext))
 
-    def __get_deps(self, src):
-        return self.compiler.dependencies(src, include_path=self.incpath)
+    def __digest(self, path):
+        """
+        Content digest of a file. It is only recalculated when the modification time or size of the file changed.
+        """
+        path = path.abs_str()
+        st = os.stat(path)
+        entry = self.digests.get(path)
+        if entry is not None and entry[0] == st.st_mtime and entry[1] == st.st_size:
+            return entry[2]
+
+        digest = utils.digest_file(path)
+        self.digests[path] = [st.st_mtime, st.st_size, digest]
+        return digest
+
+    def __fingerprint(self, command, srcfile, deps):
+        """
+        Fingerprint of an output file: the command fingerprint plus the contents of the source and its dependencies.
+        :return: The fingerprint, or None when the dependencies are not known or have gone.
+        """
+        if deps is None:
+            return None
+
+        items = [command, srcfile.abs_str()]
+        try:
+            for dep in [srcfile] + list(deps):
+                items += [dep.abs_str(), self.__digest(dep)]
+        except OSError:
+            return None
+
+        return utils.digest_strings(*items)
 
     def __compile(self, srcfile, incremental=True):
+        """
+        Compiles a single source file (if needed). May run on a worker thread, so it does not save the cache.
+        :return: Tuple of the object file and whether or not it was compiled
+        """
 
         if srcfile not in self.srcfiles:
-            raise RuntimeError("Build does not known '%s'", srcfile)
+            raise RuntimeError("Build does not known '%s'" % srcfile)
 
-        deps = self.src2deps[srcfile]
+        command = self.compiler.fingerprint(["-c"], include_path=self.incpath, symbols=self.symbols)
 
-        objfile = self.__get_tmp_file(srcfile, "o")
+        # Another build may have compiled this source with the same command before, its manifest tells the
+        # dependencies when we do not know them ourselves.
+        with profiler.phase("dependency scan", srcfile):
+            try:
+                key = utils.digest_strings(command, srcfile.abs_str(), self.__digest(srcfile))
+            except OSError:
+                raise RuntimeError("Unable to read '%s'" % srcfile)
 
-        if incremental and deps is not None and objfile.is_newer(*deps, srcfile):
-            return objfile
+            deps = self.src2deps[srcfile]
+            if deps is None:
+                deps = self.store.get_deps(key)
+
+            fp = self.__fingerprint(command, srcfile, deps)
+
+        if incremental and fp is not None and self.store.has_object(fp):
+            self.src2deps[srcfile] = deps
+            self.src2fp[srcfile] = fp
+            return self.store.get_object(fp), False
+
+        objfile = self.__get_tmp_file(srcfile, "o")
+        depfile = self.__get_tmp_file(srcfile, "d")
+        with profiler.phase("compile", srcfile):
+            self.compiler.compile(srcfile, objfile, include_path=self.incpath, symbols=self.symbols, depfile=depfile)
+        deps = read_depfile(depfile)
+        fp = self.__fingerprint(command, srcfile, deps)
 
-        deps = self.__get_deps(srcfile)
         self.src2deps[srcfile] = deps
-        self.__save_cache()
-        self.compiler.compile(srcfile, objfile, include_path=self.incpath, symbols=self.symbols)
+        self.src2fp[srcfile] = fp if objfile.is_file() else None
 
-        return objfile
+        if self.src2fp[srcfile] is None:
+            return objfile, True
+
+        return self.store.put(fp, objfile, key, deps), True
 
     def preprocess(self, srcfile, use_fake_libc=True):
         """
@@ -271,28 +605,77 @@ class Build:
         """
 
         ppfile = self.__get_tmp_file(srcfile, "pp")
-        deps = self.src2deps[srcfile]
+        includes = [Path(INCLUDE_FAKE_LIB_C)] + self.incpath if use_fake_libc else self.incpath
+        command = self.compiler.fingerprint(["-E"], include_path=includes, symbols=self.symbols)
 
-        if deps is not None and ppfile.is_newer(*deps, srcfile):
+        if ppfile.is_file() and self.src2ppfp.get(srcfile) is not None and \
+                self.src2ppfp[srcfile] == self.__fingerprint(command, srcfile, self.src2ppdeps.get(srcfile)):
             return ppfile
 
-        deps = self.__get_deps(srcfile)
-        self.src2deps[srcfile] = deps
-        self.__save_cache()
-
-        includes = [Path(INCLUDE_FAKE_LIB_C)] + list(self.incpath) if use_fake_libc else self.incpath
+        depfile = self.__get_tmp_file(srcfile, "pp.d")
+        with profiler.phase("preprocess", srcfile):
+            self.compiler.preprocess(srcfile, ppfile, include_path=includes, symbols=self.symbols, depfile=depfile)
+        self.src2ppdeps[srcfile] = read_depfile(depfile)
+        self.src2ppfp[srcfile] = self.__fingerprint(command, srcfile, self.src2ppdeps[srcfile]) if ppfile.is_file() \
+            else None
 
-        self.compiler.preprocess(srcfile, ppfile, include_path=includes, symbols=self.symbols)
         return ppfile
 
     def parse(self, srcfile):
         ppfile = self.preprocess(srcfile)
-        return cp.parse_file(ppfile.abs_str(), use_cpp=False,  parser=PARSER())
+        return cindex.parse_file(ppfile)
 
-    def compile_all(self, incremental=True):
-        objfiles = []
-        for srcfile in self.srcfiles:
-            objfiles.append(self.__compile(srcfile, incremental))
+    def index(self, srcfile):
+        """
+        Lists the functions declared and defined in the provided source file. The file is only parsed when its
+        preprocessed output has not been indexed before.
+        :return: List of cindex.Function
+        """
+        ppfile = self.preprocess(srcfile)
+        digest = self.__digest(ppfile)
+
+        functions = self.index_cache.get(digest)
+        if functions is None:
+            log.verbose("Parsing %(srcfile)s", srcfile=srcfile)
+            with profiler.phase("parse", srcfile):
+                functions = cindex.index_ast(cindex.parse_file(ppfile))
+            self.index_cache.put(digest, functions)
+
+        return functions
+
+    def __is_linked(self):
+        """
+        Whether the binary is still the one this build linked.
+        """
+        try:
+            return self.bin_digest is not None and self.__digest(self.binfile) == self.bin_digest
+        except OSError:
+            return False
 
-        if self.binfile.is_older(*objfiles):
-            self.compiler.link(self.binfile, *objfiles)
+    def compile_all(self, incremental=True, jobs=1):
+        """
+        Compiles all sources and links them. Object files are independent, so up to jobs compilers run at once.
+        :param incremental: When False, always recompile
+        :param jobs:        Maximum number of concurrent compiler processes
+        """
+        srcfiles = sorted(self.srcfiles, key=str)
+
+        # Also keep what has been compiled so far when interrupted
+        try:
+            if jobs > 1 and len(srcfiles) > 1:
+                with utils.ContextThreadPoolExecutor(max_workers=min(jobs, len(srcfiles))) as executor:
+                    results = list(executor.map(lambda srcfile: self.__compile(srcfile, incremental), srcfiles))
+            else:
+                results = [self.__compile(srcfile, incremental) for srcfile in srcfiles]
+
+            objfiles = [objfile for objfile, _ in results]
+
+            link_fp = utils.digest_strings(self.compiler.fingerprint(self.link_flags),
+                                           *(str(self.src2fp[src]) for src in srcfiles))
+            if not incremental or link_fp != self.link_fp or not self.__is_linked():
+                with profiler.phase("link", self.binfile):
+                    self.compiler.link(self.binfile, *objfiles, flags=self.link_flags)
+                self.link_fp = link_fp if self.binfile.is_file() else None
+                self.bin_digest = self.__digest(self.binfile) if self.link_fp is not None else None
+        finally:
+            self.save()
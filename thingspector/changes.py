@@ -0,0 +1,81 @@
+import os
+from thingspector import builder
+from thingspector import utils
+from thingspector.utils import log
+
+# Change-based test selection: which tests are affected by a set of changed files, according to the dependencies
+# recorded by their builds.
+
+
+def git_changed_files(rev="HEAD"):
+    """
+        Lists the files changed in the working tree compared to a git revision.
+        :return: List of absolute paths
+    """
+    # Anything starting with a dash would be taken as an option by git
+    if rev.startswith("-"):
+        raise RuntimeError("Invalid git revision '%s'" % rev)
+
+    toplevel, rv = utils.exec2str("git", "rev-parse", "--show-toplevel")
+    if rv != 0:
+        raise RuntimeError("Not in a git repository, use --changed-files instead")
+
+    output, rv = utils.exec2str("git", "diff", "--name-only", rev, "--")
+    if rv != 0:
+        raise RuntimeError("Unable to list the changes since '%s'" % rev)
+
+    toplevel = toplevel.strip()
+    return [os.path.abspath(os.path.join(toplevel, name)) for name in output.split("\n") if len(name.strip()) > 0]
+
+
+def dependency_index(tests, builds=None):
+    """
+        Builds the project-wide dependency index: per test, the files it depends on. These are the sources and
+        headers recorded by its build, its test file and declared inputs.
+        :param builds: Dict of test name to Build, for tests of which the build is in memory (the others are read
+                       from their build cache)
+        :return: Dict of test name to a set of absolute paths, or to None when the test has no (complete)
+                 dependency record yet
+    """
+    index = {}
+    for test in tests:
+        if builds is not None and test.name in builds:
+            files = builds[test.name].dependencies()
+        else:
+            files = builder.read_dependencies(test.testbin)
+        if files is not None:
+            files.add(test.testsrc.abs_str())
+            files.update(path.abs_str() for path in test.inputs)
+        index[test.name] = files
+    return index
+
+
+def affected_tests(tests, changed, config_file=None, builds=None):
+    """
+        Selects the tests affected by the changed files. Tests without a dependency record are always affected, as
+        are all tests when the configuration itself changed.
+        :param tests:       List of TestConfig
+        :param changed:     Changed files (paths)
+        :param config_file: Path of inspect.yaml
+        :param builds:      See dependency_index
+        :return: List of the affected TestConfig, in the order of tests
+    """
+    changed = set(os.path.abspath(str(path)) for path in changed)
+
+    if config_file is not None and os.path.abspath(str(config_file)) in changed:
+        log.verbose("Configuration changed, all tests are affected")
+        return list(tests)
+
+    index = dependency_index(tests, builds)
+    affected = []
+    for test in tests:
+        files = index[test.name]
+        if files is None:
+            log.verbose("Test %(name)s has no dependency record, considered affected", name=test.name)
+            affected.append(test)
+        elif not files.isdisjoint(changed):
+            log.verbose("Test %(name)s is affected by %(files)s", name=test.name,
+                        files=", ".join(sorted(files & changed)))
+            affected.append(test)
+
+    return affected
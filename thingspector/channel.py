@@ -0,0 +1,181 @@
+import struct
+
+# The result channel between a test runner and Thingspector, see thingspector.c for the writing side.
+#
+# Results are written as records on a dedicated file descriptor (passed in ENV_FD), so whatever the code under test
+# prints on stdout can not interfere. A record is a type byte and a 32 bit little-endian payload length, followed by
+# the payload. When there is no channel (i.e. on Windows), the runtime prints the same results as "$$<TYPE>|..."
+# lines on stdout.
+#
+# Whatever the code under test prints stays on stdout, with a MARK character written for every record. That tells
+# where the console output belongs among the records, see interleave.
+#
+# In quiet mode (ENV_QUIET set) passing assertions are not reported, only counted in a SUMMARY per case.
+#
+# The limits of a case are passed in the environment as well: the timeout (ms, enforced by the fork server, which
+# reports a TIMEOUT for a case it killed), CPU time (s) and address space (bytes).
+
+ENV_FD = "THINGSPECTOR_FD"
+ENV_QUIET = "THINGSPECTOR_QUIET"
+ENV_TIMEOUT = "THINGSPECTOR_TIMEOUT"
+ENV_CPU_LIMIT = "THINGSPECTOR_CPU_LIMIT"
+ENV_MEMORY_LIMIT = "THINGSPECTOR_MEMORY_LIMIT"
+
+# Record (event) types
+CASE, ASSERT_BEGIN, ASSERT_OK, ASSERT_FAIL, CASE_END, EXIT, SUMMARY, BENCH, HEAP, PERF, TIMEOUT = range(1, 12)
+# Events which are not records
+CONSOLE, INVALID = 100, 101
+
+# Written on stdout for every record (ASCII record separator)
+MARK = "\x1e"
+
+_HEADER = struct.Struct("<BI")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+# Index, samples, iterations per sample, min/median/p95 sample time in ns
+_BENCH = struct.Struct("<IIQQQQ")
+# Allocations, bytes allocated, peak bytes in use, bytes in use (leaked) at the end
+_HEAP = struct.Struct("<QQQQ")
+# Exit code, followed by the wall time (ns), user and system time (us) of the case process
+_EXIT = struct.Struct("<iQQQ")
+# Instructions, cycles and cache misses, all ones when not available
+_PERF = struct.Struct("<QQQ")
+_PERF_NA = (1 << 64) - 1
+
+
+def _decode_str(payload):
+    return payload.decode("utf-8", "replace")
+
+
+def _decode_record(rtype, payload):
+    if rtype == CASE:
+        return CASE, _U32.unpack_from(payload)[0], _decode_str(payload[4:])
+    elif rtype == ASSERT_BEGIN:
+        return ASSERT_BEGIN, _decode_str(payload[4:]), _U32.unpack_from(payload)[0]
+    elif rtype == ASSERT_OK:
+        return ASSERT_OK,
+    elif rtype == ASSERT_FAIL:
+        return ASSERT_FAIL, _decode_str(payload)
+    elif rtype == CASE_END:
+        return CASE_END, _U64.unpack_from(payload)[0]
+    elif rtype == EXIT:
+        return (EXIT, ) + _EXIT.unpack_from(payload)
+    elif rtype == SUMMARY:
+        return SUMMARY, _U32.unpack_from(payload)[0], _U32.unpack_from(payload, 4)[0]
+    elif rtype == BENCH:
+        idx, samples, iterations, t_min, t_median, t_p95 = _BENCH.unpack_from(payload)
+        return BENCH, idx, _decode_str(payload[_BENCH.size:]), iterations, samples, t_min, t_median, t_p95
+    elif rtype == HEAP:
+        return (HEAP, ) + _HEAP.unpack_from(payload)
+    elif rtype == PERF:
+        return (PERF, ) + tuple(None if v == _PERF_NA else v for v in _PERF.unpack_from(payload))
+    elif rtype == TIMEOUT:
+        return TIMEOUT, _U32.unpack_from(payload)[0]
+    return INVALID, "record type %d" % rtype
+
+
+def decode(data):
+    """
+        Decodes the records written to the result channel.
+        :return: List of event tuples, (type, fields...)
+    """
+    events = []
+    pos = 0
+
+    while pos + _HEADER.size <= len(data):
+        rtype, length = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        payload = data[pos:pos + length]
+        pos += length
+
+        # The process died while writing
+        if len(payload) < length:
+            break
+
+        try:
+            events.append(_decode_record(rtype, payload))
+        except struct.error:
+            events.append((INVALID, "truncated record type %d" % rtype))
+
+    return events
+
+
+def console(output):
+    """
+        Turns console output into CONSOLE events, one per non-empty line.
+    """
+    return [(CONSOLE, line.strip()) for line in output.split("\n") if len(line.strip()) > 0]
+
+
+def interleave(output, events):
+    """
+        Puts the console output of a runner which used the result channel in between its records: the text before
+        the n-th MARK was printed before the n-th record.
+        :param output: Everything the runner printed on stdout
+        :param events: The decoded records
+        :return: List of event tuples, console output included
+    """
+    chunks = output.split(MARK)
+    result = []
+    for k, event in enumerate(events):
+        if k < len(chunks):
+            result += console(chunks[k])
+        result.append(event)
+    # Printed after the last record, or left by records which were lost
+    for chunk in chunks[len(events):]:
+        result += console(chunk)
+    return result
+
+
+def parse_text(output):
+    """
+        Parses the results printed on stdout, when there is no result channel.
+        :return: List of event tuples, console output included
+    """
+    events = []
+
+    for line in output.split("\n"):
+        line = line.strip()
+
+        if len(line) == 0:
+            continue
+
+        # Console output
+        if not line.startswith("$$"):
+            events.append((CONSOLE, line))
+            continue
+
+        p = line.split("|")
+        cmd = p[0][2:]
+        par = p[1:]
+
+        try:
+            if cmd == "CASE" and len(par) == 1:
+                events.append((CASE, -1, par[0]))
+            elif cmd == "ASSERT_BEGIN" and len(par) == 2:
+                events.append((ASSERT_BEGIN, par[0], int(par[1])))
+            elif cmd == "ASSERT_END" and len(par) >= 1:
+                if par[0] == "OK":
+                    events.append((ASSERT_OK, ))
+                else:
+                    events.append((ASSERT_FAIL, "|".join(par)))
+            elif cmd == "CASE_END" and len(par) == 1:
+                events.append((CASE_END, int(par[0])))
+            elif cmd == "EXIT" and len(par) == 4:
+                events.append((EXIT, ) + tuple(int(p) for p in par))
+            elif cmd == "SUMMARY" and len(par) == 2:
+                events.append((SUMMARY, int(par[0]), int(par[1])))
+            elif cmd == "BENCH" and len(par) == 6:
+                events.append((BENCH, -1, par[0]) + tuple(int(p) for p in par[1:]))
+            elif cmd == "HEAP" and len(par) == 4:
+                events.append((HEAP, ) + tuple(int(p) for p in par))
+            elif cmd == "PERF" and len(par) == 3:
+                events.append((PERF, ) + tuple(None if int(p) < 0 else int(p) for p in par))
+            elif cmd == "TIMEOUT" and len(par) == 1:
+                events.append((TIMEOUT, int(par[0])))
+            else:
+                events.append((INVALID, line))
+        except ValueError:
+            events.append((INVALID, line))
+
+    return events
@@ -0,0 +1,390 @@
+import importlib.util
+import inspect
+import json
+import re
+import sys
+import threading
+from thingspector import utils
+from thingspector.utils import log
+
+# pycparser (and pycparserext) take a while to import, and are only needed when a file is actually parsed. They are
+# imported by _load_parser() on first use.
+cp = None
+PARSER = None
+GENERATOR = None
+FUNC_DECLS = None
+
+# The GNU parser of pycparserext is used when it is installed
+PARSER_NAME = "gnucparser" if importlib.util.find_spec("pycparserext") is not None else "cparser"
+
+# Bump when the contents of an index change, so cached indexes are no longer used
+INDEX_VERSION = 1
+
+
+class Function:
+    """
+        A function declaration or definition at file level, as far as Thingspector needs to know it.
+    """
+
+    def __init__(self, name, is_definition, storage, funcspec, signature):
+        self.name = name
+        self.is_definition = is_definition
+        self.storage = storage
+        self.funcspec = funcspec
+        self.signature = signature
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "definition": self.is_definition,
+            "storage": self.storage,
+            "funcspec": self.funcspec,
+            "signature": self.signature
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return Function(d["name"], d["definition"], d["storage"], d["funcspec"], d["signature"])
+
+    def __repr__(self):
+        return self.signature
+
+
+_parsers = threading.local()
+_load_lock = threading.Lock()
+
+
+def _load_parser():
+    """
+        Imports the parser modules.
+    """
+    global cp, PARSER, GENERATOR, FUNC_DECLS
+
+    with _load_lock:
+        if PARSER is not None:
+            return
+
+        import pycparser
+        if PARSER_NAME == "gnucparser":
+            import pycparserext.ext_c_parser as ecp
+            import pycparserext.ext_c_generator as ecg
+            GENERATOR = ecg.GnuCGenerator
+            # The GNU parser has its own function declaration node (for attributes and asm)
+            FUNC_DECLS = (pycparser.c_ast.FuncDecl, ecp.FuncDeclExt)
+            PARSER = ecp.GnuCParser
+        else:
+            GENERATOR = pycparser.c_generator.CGenerator
+            FUNC_DECLS = (pycparser.c_ast.FuncDecl, )
+            PARSER = pycparser.CParser
+        cp = pycparser
+
+
+def _table_dir():
+    """
+        Where the lexer and parser tables are generated, per parser and pycparser version.
+        :return: Tuple of the directory and the prefix of the table modules
+    """
+    prefix = "ts_%s_%s" % (PARSER_NAME, cp.__version__.replace(".", "_"))
+    return utils.CACHE_ROOT + ("tables", prefix), prefix
+
+
+def _accepts_tables(parser_class):
+    """
+        Whether the parser takes the PLY table options (older pycparser versions), following constructors which pass
+        their keyword arguments on to a base class.
+    """
+    for cls in parser_class.__mro__:
+        if cls is object or "__init__" not in vars(cls):
+            continue
+        parameters = inspect.signature(cls.__init__).parameters
+        if "taboutputdir" in parameters:
+            return True
+        if not any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+            return False
+    return False
+
+
+def get_parser():
+    """
+        Returns the parser of the calling thread. It is built once, with its lexer and parser tables kept in the
+        cache directory, so later processes import the tables instead of generating them.
+    """
+    parser = getattr(_parsers, "parser", None)
+    if parser is not None:
+        return parser
+
+    _load_parser()
+    table_dir, prefix = _table_dir()
+    tabdir = table_dir.abs_str()
+    try:
+        if not table_dir.is_dir():
+            table_dir.mkdirs()
+    except OSError:
+        # Tables are then generated each time
+        pass
+
+    # The tables are imported as modules: ours through sys.path, and pycparserext (which insists on naming them
+    # pycparserext.lextab/yacctab) through its package path.
+    if tabdir not in sys.path:
+        sys.path.append(tabdir)
+    package = sys.modules.get(PARSER.__module__.split(".")[0])
+    if package is not None and hasattr(package, "__path__") and tabdir not in package.__path__:
+        package.__path__.append(tabdir)
+
+    if _accepts_tables(PARSER):
+        parser = PARSER(lex_optimize=True, yacc_optimize=True,
+                        lextab=prefix + "_lextab", yacctab=prefix + "_yacctab",
+                        taboutputdir=tabdir)
+    else:
+        # Parser without PLY tables
+        parser = PARSER()
+
+    _parsers.parser = parser
+    return parser
+
+
+def parse_file(ppfile):
+    """
+        Parses a preprocessed file.
+    """
+    parser = get_parser()
+    return cp.parse_file(ppfile.abs_str(), use_cpp=False, parser=parser)
+
+
+def index_ast(ast):
+    """
+        Lists the functions declared or defined at file level, in file order.
+    """
+    _load_parser()
+    generator = GENERATOR()
+    functions = []
+
+    for a in ast.ext:
+        if isinstance(a, cp.c_ast.Decl) and isinstance(a.type, FUNC_DECLS):
+            decl, is_definition = a, False
+        elif isinstance(a, cp.c_ast.FuncDef):
+            decl, is_definition = a.decl, True
+        else:
+            continue
+
+        # GNU attributes end up in funcspec as nodes, only the keywords matter
+        funcspec = [spec for spec in decl.funcspec if isinstance(spec, str)]
+        functions.append(Function(decl.name, is_definition, list(decl.storage), funcspec, generator.visit(decl)))
+
+    return functions
+
+
+class IndexCache:
+    """
+        Function indexes of preprocessed files by the digest of their contents, shared by all builds in a work
+        directory. A file which preprocesses to the same output as before is never parsed again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __get_file(self, digest):
+        key = utils.digest_strings(digest, str(INDEX_VERSION), PARSER_NAME)
+        return self.root + (key[:2], "%s.json" % key)
+
+    def get(self, digest):
+        """
+        :return: List of Function, or None when not cached
+        """
+        indexfile = self.__get_file(digest)
+        if not indexfile.is_file():
+            return None
+
+        try:
+            with indexfile.open("r") as stream:
+                return [Function.from_dict(d) for d in json.load(stream)]
+        except (OSError, ValueError, KeyError) as e:
+            log.trace("Ignoring index %(file)s: %(error)s", file=indexfile, error=e)
+            return None
+
+    def put(self, digest, functions):
+        indexfile = self.__get_file(digest)
+        try:
+            utils.write_atomic(indexfile, json.dumps([f.to_dict() for f in functions], separators=(",", ":")))
+        except OSError as e:
+            log.trace("Unable to write index %(file)s: %(error)s", file=indexfile, error=e)
+
+
+# =====================================================================================================================
+#  Quick scanner
+# =====================================================================================================================
+
+_TOKEN_RE = re.compile(r'''
+      (?P<comment>/\*.*?\*/|//[^\n]*)
+    | (?P<literal>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<newline>\n)
+    | (?P<space>[ \t\r\f\v]+)
+    | (?P<punct>.)
+''', re.VERBOSE | re.DOTALL)
+
+_STORAGE = ("static", "extern", "auto", "register", "typedef", "_Thread_local")
+_FUNCSPEC = ("inline", "__inline", "__inline__", "_Noreturn")
+
+
+class _Ambiguous(Exception):
+    pass
+
+
+def _logical_lines(text):
+    """
+        Joins the lines continued with a backslash, followed by an empty line for each line joined, so the number of
+        lines stays the same.
+    """
+    physical = text.split("\n")
+    i = 0
+    while i < len(physical):
+        line = physical[i]
+        joined = 0
+        while line.rstrip("\r").endswith("\\") and i + joined + 1 < len(physical):
+            joined += 1
+            line = line.rstrip("\r")[:-1] + physical[i + joined]
+        yield line
+        for _ in range(joined):
+            yield ""
+        i += joined + 1
+
+
+def _active_lines(text):
+    """
+        Removes the preprocessor lines and the code disabled by #if 0 (or the #else of #if 1). Any other conditional
+        depends on macros the scanner does not know about, and makes the file ambiguous.
+    """
+    lines = []
+    # Per #if level: is the current branch active, and has an active branch been taken already
+    stack = []
+
+    for line in _logical_lines(text):
+        stripped = line.strip()
+        active = all(level[0] for level in stack)
+
+        if not stripped.startswith("#"):
+            lines.append(line if active else "")
+            continue
+
+        lines.append("")
+        directive = stripped[1:].split()
+        directive = directive[0] if directive else ""
+        argument = stripped[1:].strip()[len(directive):].strip()
+
+        if directive in ("if", "ifdef", "ifndef"):
+            if directive == "if" and argument in ("0", "1"):
+                stack.append([argument == "1", argument == "1"])
+            elif not active:
+                # Nested in disabled code, the condition does not matter
+                stack.append([False, True])
+            else:
+                raise _Ambiguous()
+        elif directive == "else":
+            if len(stack) == 0:
+                raise _Ambiguous()
+            stack[-1] = [not stack[-1][1], True]
+        elif directive == "elif":
+            if len(stack) == 0 or (all(level[0] for level in stack[:-1]) and not stack[-1][1]):
+                raise _Ambiguous()
+            stack[-1] = [False, True]
+        elif directive == "endif":
+            if len(stack) == 0:
+                raise _Ambiguous()
+            stack.pop()
+        elif directive == "define" and active and len(argument) > 0 and "(" in argument.split()[0]:
+            # Function-like macros may well generate functions
+            raise _Ambiguous()
+
+    if len(stack) > 0:
+        raise _Ambiguous()
+
+    return "\n".join(lines)
+
+
+def _tokens(text):
+    # Line continuations have been joined, and the preprocessor lines are gone, by _active_lines
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind in ("comment", "space", "newline"):
+            continue
+        yield kind, m.group()
+
+
+def _scan(text):
+    # Comments may hide preprocessor lines, so drop them first (keeping the lines they span)
+    text = _TOKEN_RE.sub(lambda m: "\n" * m.group().count("\n") if m.lastgroup == "comment" else m.group(), text)
+
+    functions = []
+    decl = []
+    depth = 0
+
+    for kind, token in _tokens(_active_lines(text)):
+        if depth > 0:
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth -= 1
+            continue
+
+        if token == ";":
+            decl = []
+        elif token == "{":
+            if len(decl) > 0 and decl[-1] == ")":
+                functions.append(_to_function(decl))
+                decl = []
+            # Otherwise a struct, union, enum or initializer, the declaration continues after it
+            depth = 1
+        elif token == "}":
+            raise _Ambiguous()
+        else:
+            decl.append(token)
+
+    if depth != 0:
+        raise _Ambiguous()
+
+    return functions
+
+
+def _to_function(decl):
+    """
+        Turns the tokens of a definition, up to its parameter list, into a Function.
+    """
+    # Find the opening parenthesis of the parameter list
+    level = 0
+    for i in range(len(decl) - 1, -1, -1):
+        if decl[i] == ")":
+            level += 1
+        elif decl[i] == "(":
+            level -= 1
+            if level == 0:
+                break
+    else:
+        raise _Ambiguous()
+
+    # Without a return type, it is probably a macro invocation. Names like __attribute__ are not functions either.
+    if i < 2 or not re.match(r"[A-Za-z_]", decl[i - 1]) or decl[i - 1].startswith("__") or "=" in decl:
+        raise _Ambiguous()
+
+    specifiers = decl[:i - 1]
+    signature = " ".join(decl).replace(" ( ", "(").replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+
+    return Function(decl[i - 1], True,
+                    [s for s in specifiers if s in _STORAGE],
+                    [s for s in specifiers if s in _FUNCSPEC],
+                    signature)
+
+
+def scan_file(srcfile):
+    """
+        Lists the functions defined in a C file by scanning its tokens, without preprocessing or parsing it. Only
+        what is defined in the file itself is found, not what is in the headers it includes.
+        :return: List of Function, or None when the file is too involved to tell for sure.
+    """
+    try:
+        with srcfile.open("r") as stream:
+            return _scan(stream.read())
+    except _Ambiguous:
+        return None
+    except (OSError, UnicodeDecodeError):
+        return None
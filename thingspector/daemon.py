@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+
+# Optional background server which keeps the state of Thingspector warm between runs: the configuration, the
+# compilers, the parser and the builds. The CLI hands its command to the daemon when one is running in the working
+# directory, and runs it itself otherwise. Only the client side is imported by the CLI, the server imports what it
+# needs when it starts.
+
+# Unix socket of the daemon, next to inspect.yaml, so the client finds it without loading the configuration
+SOCKET = ".thingspector.sock"
+
+
+def request(args):
+    """
+        Runs a command on the daemon of the working directory, printing its output as it arrives.
+        :param args: Command line, without the program
+        :return: The exit code of the command, or None when no daemon is running
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps({"args": args}).encode() + b"\n")
+        stream.flush()
+
+        for line in stream:
+            message = json.loads(line)
+            if "output" in message:
+                print(message["output"], end="", flush=True)
+            elif "exit" in message:
+                return message["exit"]
+
+    raise RuntimeError("Lost the connection to the daemon")
+
+
+class _Output:
+    """
+        File-like object which forwards what is printed to a client.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(json.dumps({"output": text}).encode() + b"\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def serve(handler):
+    """
+        Serves requests until interrupted. Clients are accepted concurrently, but their commands run one at a time:
+        they share the state and the output of this process.
+        :param handler: Function of the command line, which runs the command and returns its exit code
+    """
+    import contextlib
+    import signal
+    import socketserver
+    import sys
+    import threading
+    from thingspector.utils import log
+
+    if _is_running():
+        raise RuntimeError("A daemon is already running in this directory")
+    # Left behind by a daemon which did not stop cleanly
+    if os.path.exists(SOCKET):
+        os.unlink(SOCKET)
+
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = json.loads(line)["args"]
+
+            with lock:
+                output = _Output(self.wfile)
+                try:
+                    with contextlib.redirect_stdout(output):
+                        try:
+                            code = handler(args)
+                        except RuntimeError as e:
+                            print("Error: %s" % e)
+                            code = 1
+                    self.wfile.write(json.dumps({"exit": code}).encode() + b"\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    log.warning("Client went away during %(args)s", args=" ".join(args))
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    # Also clean up when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with Server(SOCKET, Handler) as server:
+        log.info("Serving on %(socket)s, press Ctrl+C to stop", socket=SOCKET)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(SOCKET)
+
+
+def _is_running():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
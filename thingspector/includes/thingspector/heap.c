@@ -0,0 +1,236 @@
+/*
+    Thingspector heap instrumentation, linked into a test runner when heap tracking is enabled.
+
+    The test objects are linked with --wrap for malloc, calloc, realloc and free, so their calls end up here. The
+    memory itself comes straight from the C library: the pointers handed out are the library's own, so the library
+    may realloc or free them internally (i.e. getline or open_memstream on a buffer of the test). The sizes of the
+    live allocations are kept in a table on the side, keyed by pointer, to know how much is released by free.
+    Pointers which are not in the table (allocated inside the C library, i.e. by strdup) are passed on untouched.
+
+    Allocations which the C library reallocates or frees internally are not seen, their old size stays counted as
+    live until the address is handed out again.
+
+    A runner process (or forked child) runs a single case, so the counters cover exactly one case, its setup and
+    teardown included.
+ */
+#include <stdlib.h>
+#include <string.h>
+
+#include "thingspector.h"
+
+/* Initial number of slots of the table, a power of two */
+#define TS_HEAP_SLOTS 256
+
+typedef struct {
+    /* NULL for a free slot, TS_HEAP_GONE for a removed entry */
+    void *ptr;
+    size_t size;
+} ts_heap_entry;
+
+void *__real_malloc(size_t size);
+void *__real_calloc(size_t nmemb, size_t size);
+void *__real_realloc(void *ptr, size_t size);
+void __real_free(void *ptr);
+
+static unsigned long long ts_heap_allocs_n;
+static unsigned long long ts_heap_bytes_n;
+static unsigned long long ts_heap_live_n;
+static unsigned long long ts_heap_peak_n;
+
+static char ts_heap_gone;
+#define TS_HEAP_GONE ((void *)&ts_heap_gone)
+
+static ts_heap_entry *ts_heap_table;
+static size_t ts_heap_slots;
+/* Slots in use by entries and by removed entries */
+static size_t ts_heap_used;
+static size_t ts_heap_removed;
+
+static size_t ts_heap_hash(const void *ptr)
+{
+    size_t h = (size_t)ptr;
+
+    /* Allocations are aligned, the low bits tell nothing */
+    h ^= h >> 17;
+    h *= (size_t)0x9e3779b97f4a7c15ull;
+    return h ^ (h >> 29);
+}
+
+/* Returns the slot of ptr, or the free slot where it would go */
+static ts_heap_entry *ts_heap_find(const void *ptr)
+{
+    size_t i = ts_heap_hash(ptr) & (ts_heap_slots - 1);
+    ts_heap_entry *reuse = NULL;
+
+    for (;;) {
+        ts_heap_entry *entry = &ts_heap_table[i];
+
+        if (entry->ptr == ptr) {
+            return entry;
+        }
+        if (entry->ptr == NULL) {
+            return reuse != NULL ? reuse : entry;
+        }
+        if (entry->ptr == TS_HEAP_GONE && reuse == NULL) {
+            reuse = entry;
+        }
+        i = (i + 1) & (ts_heap_slots - 1);
+    }
+}
+
+/* Keeps the table at most three quarters full, returns 0 when it could not grow */
+static int ts_heap_reserve(void)
+{
+    ts_heap_entry *old = ts_heap_table;
+    size_t old_slots = ts_heap_slots;
+    size_t slots, i;
+
+    if (ts_heap_table != NULL && (ts_heap_used + 1) * 4 < ts_heap_slots * 3) {
+        return 1;
+    }
+
+    /* Only grow when the entries themselves fill it, otherwise dropping the removed ones is enough */
+    slots = old_slots == 0 ? TS_HEAP_SLOTS :
+            (ts_heap_used - ts_heap_removed + 1) * 2 >= old_slots ? old_slots * 2 : old_slots;
+    ts_heap_table = __real_calloc(slots, sizeof(ts_heap_entry));
+    if (ts_heap_table == NULL) {
+        ts_heap_table = old;
+        return 0;
+    }
+    ts_heap_slots = slots;
+    ts_heap_used = 0;
+    ts_heap_removed = 0;
+
+    for (i = 0; i < old_slots; i++) {
+        if (old[i].ptr != NULL && old[i].ptr != TS_HEAP_GONE) {
+            *ts_heap_find(old[i].ptr) = old[i];
+            ts_heap_used++;
+        }
+    }
+    __real_free(old);
+    return 1;
+}
+
+/* Removes ptr from the table, returns 0 when it is not there */
+static int ts_heap_untrack(void *ptr, size_t *size)
+{
+    ts_heap_entry *entry;
+
+    if (ts_heap_table == NULL) {
+        return 0;
+    }
+
+    entry = ts_heap_find(ptr);
+    if (entry->ptr != ptr) {
+        return 0;
+    }
+
+    *size = entry->size;
+    entry->ptr = TS_HEAP_GONE;
+    ts_heap_removed++;
+    ts_heap_live_n -= *size;
+    return 1;
+}
+
+static void *ts_heap_track(void *ptr, size_t size)
+{
+    ts_heap_entry *entry;
+    size_t stale;
+
+    if (ptr == NULL) {
+        return NULL;
+    }
+
+    /* Freed inside the C library and handed out again */
+    ts_heap_untrack(ptr, &stale);
+
+    ts_heap_allocs_n++;
+    ts_heap_bytes_n += size;
+    ts_heap_live_n += size;
+    if (ts_heap_live_n > ts_heap_peak_n) {
+        ts_heap_peak_n = ts_heap_live_n;
+    }
+
+    if (!ts_heap_reserve()) {
+        /* Counted, but its release will not be */
+        return ptr;
+    }
+
+    entry = ts_heap_find(ptr);
+    if (entry->ptr == TS_HEAP_GONE) {
+        ts_heap_removed--;
+    } else {
+        ts_heap_used++;
+    }
+    entry->ptr = ptr;
+    entry->size = size;
+    return ptr;
+}
+
+void *__wrap_malloc(size_t size)
+{
+    return ts_heap_track(__real_malloc(size), size);
+}
+
+void *__wrap_calloc(size_t nmemb, size_t size)
+{
+    /* calloc itself fails on overflow */
+    return ts_heap_track(__real_calloc(nmemb, size), nmemb * size);
+}
+
+void *__wrap_realloc(void *ptr, size_t size)
+{
+    size_t old_size;
+    int tracked;
+    void *moved;
+
+    if (ptr == NULL) {
+        return __wrap_malloc(size);
+    }
+
+    tracked = ts_heap_untrack(ptr, &old_size);
+    moved = __real_realloc(ptr, size);
+
+    if (moved == NULL && size != 0) {
+        /* The original block is still there */
+        if (tracked) {
+            ts_heap_track(ptr, old_size);
+            ts_heap_allocs_n--;
+            ts_heap_bytes_n -= old_size;
+        }
+        return NULL;
+    }
+
+    /* Counted as a new allocation */
+    return tracked ? ts_heap_track(moved, size) : moved;
+}
+
+void __wrap_free(void *ptr)
+{
+    size_t size;
+
+    if (ptr != NULL) {
+        ts_heap_untrack(ptr, &size);
+    }
+    __real_free(ptr);
+}
+
+unsigned long long ts_heap_allocs(void)
+{
+    return ts_heap_allocs_n;
+}
+
+unsigned long long ts_heap_bytes(void)
+{
+    return ts_heap_bytes_n;
+}
+
+unsigned long long ts_heap_live(void)
+{
+    return ts_heap_live_n;
+}
+
+unsigned long long ts_heap_peak(void)
+{
+    return ts_heap_peak_n;
+}
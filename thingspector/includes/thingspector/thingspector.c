@@ -0,0 +1,589 @@
+/*
+    Thingspector runtime, linked into every test runner.
+
+    Results are reported as records on the result channel: the file descriptor in the THINGSPECTOR_FD environment
+    variable. Each record is a type byte and a 32 bit little-endian payload length, followed by the payload.
+    Without the variable (i.e. when running a runner by hand) results are printed on stdout as text instead.
+
+    Whatever the code under test prints stays on stdout. To tell where it belongs among the results, stdout is
+    flushed before every record and a record separator character (TS_MARK) is written to it: the text before the
+    n-th separator was printed before the n-th record.
+
+    With THINGSPECTOR_QUIET set, passing assertions are only counted. Failures are reported as usual, and the
+    counts follow in a summary record at the end of the case.
+
+    With THINGSPECTOR_HEAP defined (heap tracking, see heap.c), a heap record with the allocation counts of the case
+    precedes its end.
+
+    On Linux, the instructions, cycles and cache misses of the case body are counted with perf_event_open, when the
+    kernel allows it and its headers are available, and reported in a perf record. Cases run by the fork server are followed by their exit code
+    and resource usage (wall, user and system time).
+
+    Benchmarks (ts_bench_run) report the min/median/p95 time of batches of calls, see the TS_BENCH_* settings.
+
+    Limits (POSIX only): a case process gets the CPU time (seconds) and address space (bytes) limits of the
+    THINGSPECTOR_CPU_LIMIT and THINGSPECTOR_MEMORY_LIMIT variables. The fork server kills a case, with all processes
+    it started, after THINGSPECTOR_TIMEOUT milliseconds and reports a timeout record before its exit.
+ */
+#if defined(__linux__) && !defined(_GNU_SOURCE)
+/* For syscall() */
+#define _GNU_SOURCE
+#elif !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L
+#endif
+
+#include <stdarg.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#if defined(_WIN32)
+#include <io.h>
+#define ts_write _write
+#else
+#include <errno.h>
+#include <signal.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+#define ts_write write
+#endif
+
+/* Without the kernel headers (i.e. slim containers, some cross sysroots) there just are no counters */
+#if defined(__linux__) && defined(__has_include)
+#if __has_include(<linux/perf_event.h>)
+#include <linux/perf_event.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#if defined(SYS_perf_event_open)
+#define TS_PERF
+#endif
+#endif
+#endif
+
+#include "thingspector.h"
+
+/* Record types, see channel.py */
+#define TS_REC_CASE         1
+#define TS_REC_ASSERT_BEGIN 2
+#define TS_REC_ASSERT_OK    3
+#define TS_REC_ASSERT_FAIL  4
+#define TS_REC_CASE_END     5
+#define TS_REC_EXIT         6
+#define TS_REC_SUMMARY      7
+#define TS_REC_BENCH        8
+#define TS_REC_HEAP         9
+#define TS_REC_PERF         10
+#define TS_REC_TIMEOUT      11
+
+#define TS_MAX_RECORD 1024
+/* ASCII record separator, written on stdout for every record, see channel.interleave */
+#define TS_MARK "\x1e"
+
+/* A batch of benchmark iterations should take at least this long, to make the clock resolution irrelevant */
+#define TS_BENCH_BATCH_NS   1000000ull
+/* Number of timed batches, after calibration and a warm-up batch */
+#define TS_BENCH_SAMPLES    51
+#define TS_BENCH_MAX_ITERATIONS (1ull << 40)
+
+/* -2: not looked up yet, -1: text on stdout */
+static int ts_fd = -2;
+static unsigned long long ts_case_start;
+/* Duration of the case body, once it has ended */
+static unsigned long long ts_case_duration;
+static int ts_case_running;
+
+#if !defined(_WIN32)
+/* Start of the case process being served, see ts_case_spawn */
+static unsigned long long ts_spawn_start;
+static struct rusage ts_spawn_usage;
+#endif
+
+#ifdef TS_PERF
+#define TS_PERF_COUNTERS 3
+/* Hardware counters of the case body: instructions, cycles, cache misses; -1 when not available */
+static const unsigned long long ts_perf_config[TS_PERF_COUNTERS] = {
+    PERF_COUNT_HW_INSTRUCTIONS, PERF_COUNT_HW_CPU_CYCLES, PERF_COUNT_HW_CACHE_MISSES
+};
+static int ts_perf_fd[TS_PERF_COUNTERS] = { -1, -1, -1 };
+#endif
+
+/* Quiet mode: -1 not looked up yet, the assertion in progress and the counters of the current case */
+static int ts_quiet = -1;
+static const char *ts_assert_file;
+static int ts_assert_line;
+static unsigned long ts_assert_count;
+static unsigned long ts_assert_failed;
+
+static int ts_channel(void)
+{
+    if (ts_fd == -2) {
+        const char *fd = getenv("THINGSPECTOR_FD");
+        ts_fd = fd != NULL ? atoi(fd) : -1;
+    }
+    return ts_fd;
+}
+
+static int ts_is_quiet(void)
+{
+    if (ts_quiet == -1) {
+        const char *quiet = getenv("THINGSPECTOR_QUIET");
+        ts_quiet = quiet != NULL && strcmp(quiet, "0") != 0;
+    }
+    return ts_quiet;
+}
+
+static unsigned long long ts_now_ns(void)
+{
+#if defined(CLOCK_MONOTONIC)
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (unsigned long long)ts.tv_sec * 1000000000ull + (unsigned long long)ts.tv_nsec;
+#else
+    return (unsigned long long)clock() * (1000000000ull / CLOCKS_PER_SEC);
+#endif
+}
+
+static size_t ts_put_u32(unsigned char *p, unsigned long v)
+{
+    p[0] = (unsigned char)v;
+    p[1] = (unsigned char)(v >> 8);
+    p[2] = (unsigned char)(v >> 16);
+    p[3] = (unsigned char)(v >> 24);
+    return 4;
+}
+
+static size_t ts_put_u64(unsigned char *p, unsigned long long v)
+{
+    ts_put_u32(p, (unsigned long)(v & 0xffffffffull));
+    ts_put_u32(p + 4, (unsigned long)(v >> 32));
+    return 8;
+}
+
+/* Writes a record with a fixed part (numbers) followed by a string, as a single write, and its mark on stdout. */
+static void ts_record(int type, const unsigned char *fixed, size_t fixed_len, const char *str)
+{
+    unsigned char buf[5 + TS_MAX_RECORD];
+    size_t str_len = str != NULL ? strlen(str) : 0;
+    size_t len, done = 0;
+
+    if (fixed_len + str_len > TS_MAX_RECORD) {
+        str_len = TS_MAX_RECORD - fixed_len;
+    }
+    len = 5 + fixed_len + str_len;
+
+    buf[0] = (unsigned char)type;
+    ts_put_u32(buf + 1, (unsigned long)(fixed_len + str_len));
+    if (fixed_len > 0) {
+        memcpy(buf + 5, fixed, fixed_len);
+    }
+    if (str_len > 0) {
+        memcpy(buf + 5 + fixed_len, str, str_len);
+    }
+
+    fflush(stdout);
+#if !defined(_WIN32)
+    /* There is no channel on Windows */
+    while (ts_write(1, TS_MARK, 1) < 0 && errno == EINTR) {
+    }
+#endif
+
+    while (done < len) {
+        int n = (int)ts_write(ts_channel(), buf + done, (unsigned int)(len - done));
+        if (n <= 0) {
+#if !defined(_WIN32)
+            if (n < 0 && errno == EINTR) {
+                continue;
+            }
+#endif
+            return;
+        }
+        done += (size_t)n;
+    }
+}
+
+#ifdef TS_PERF
+static void ts_perf_start(void)
+{
+    struct perf_event_attr attr;
+    int i;
+
+    for (i = 0; i < TS_PERF_COUNTERS; i++) {
+        memset(&attr, 0, sizeof(attr));
+        attr.type = PERF_TYPE_HARDWARE;
+        attr.size = sizeof(attr);
+        attr.config = ts_perf_config[i];
+        attr.disabled = 1;
+        attr.exclude_kernel = 1;
+        attr.exclude_hv = 1;
+        ts_perf_fd[i] = (int)syscall(SYS_perf_event_open, &attr, 0, -1, -1, 0);
+    }
+    for (i = 0; i < TS_PERF_COUNTERS; i++) {
+        if (ts_perf_fd[i] >= 0) {
+            ioctl(ts_perf_fd[i], PERF_EVENT_IOC_RESET, 0);
+            ioctl(ts_perf_fd[i], PERF_EVENT_IOC_ENABLE, 0);
+        }
+    }
+}
+
+static void ts_perf_stop(void)
+{
+    unsigned long long values[TS_PERF_COUNTERS];
+    unsigned char fixed[8 * TS_PERF_COUNTERS];
+    size_t len = 0;
+    int available = 0;
+    int i;
+
+    for (i = 0; i < TS_PERF_COUNTERS; i++) {
+        values[i] = (unsigned long long)-1;
+        if (ts_perf_fd[i] >= 0) {
+            ioctl(ts_perf_fd[i], PERF_EVENT_IOC_DISABLE, 0);
+            if (read(ts_perf_fd[i], &values[i], sizeof(values[i])) == sizeof(values[i])) {
+                available = 1;
+            }
+            close(ts_perf_fd[i]);
+            ts_perf_fd[i] = -1;
+        }
+    }
+
+    if (!available) {
+        return;
+    }
+
+    if (ts_channel() < 0) {
+        printf("$$PERF|%lld|%lld|%lld\n", (long long)values[0], (long long)values[1], (long long)values[2]);
+    } else {
+        for (i = 0; i < TS_PERF_COUNTERS; i++) {
+            len += ts_put_u64(fixed + len, values[i]);
+        }
+        ts_record(TS_REC_PERF, fixed, len, NULL);
+    }
+}
+#endif
+
+void ts_case_begin(int idx, const char *name)
+{
+    unsigned char fixed[4];
+
+    if (ts_channel() < 0) {
+        printf("$$CASE|%s\n", name);
+        fflush(stdout);
+    } else {
+        ts_record(TS_REC_CASE, fixed, ts_put_u32(fixed, (unsigned long)idx), name);
+    }
+    ts_assert_count = 0;
+    ts_assert_failed = 0;
+    ts_case_running = 1;
+#ifdef TS_PERF
+    ts_perf_start();
+#endif
+    ts_case_start = ts_now_ns();
+}
+
+void ts_case_body_end(void)
+{
+    ts_case_running = 0;
+    ts_case_duration = ts_now_ns() - ts_case_start;
+#ifdef TS_PERF
+    ts_perf_stop();
+#endif
+}
+
+#ifdef THINGSPECTOR_HEAP
+static void ts_heap_report(void)
+{
+    unsigned char fixed[32];
+    size_t len = 0;
+
+    if (ts_channel() < 0) {
+        printf("$$HEAP|%llu|%llu|%llu|%llu\n", ts_heap_allocs(), ts_heap_bytes(), ts_heap_peak(), ts_heap_live());
+    } else {
+        len += ts_put_u64(fixed + len, ts_heap_allocs());
+        len += ts_put_u64(fixed + len, ts_heap_bytes());
+        len += ts_put_u64(fixed + len, ts_heap_peak());
+        len += ts_put_u64(fixed + len, ts_heap_live());
+        ts_record(TS_REC_HEAP, fixed, len, NULL);
+    }
+}
+#endif
+
+void ts_case_end(void)
+{
+    unsigned char fixed[8];
+    unsigned long long duration;
+
+    /* Not ended by the runner, i.e. a runner generated before ts_case_body_end existed */
+    if (ts_case_running) {
+        ts_case_body_end();
+    }
+    duration = ts_case_duration;
+
+#ifdef THINGSPECTOR_HEAP
+    ts_heap_report();
+#endif
+
+    if (ts_is_quiet()) {
+        if (ts_channel() < 0) {
+            printf("$$SUMMARY|%lu|%lu\n", ts_assert_count, ts_assert_failed);
+        } else {
+            ts_put_u32(fixed, ts_assert_count);
+            ts_put_u32(fixed + 4, ts_assert_failed);
+            ts_record(TS_REC_SUMMARY, fixed, 8, NULL);
+        }
+    }
+
+    if (ts_channel() < 0) {
+        printf("$$CASE_END|%llu\n", duration);
+    } else {
+        ts_record(TS_REC_CASE_END, fixed, ts_put_u64(fixed, duration), NULL);
+    }
+    fflush(stdout);
+}
+
+#if !defined(_WIN32)
+static unsigned long long ts_timeval_us(const struct timeval *tv)
+{
+    return (unsigned long long)tv->tv_sec * 1000000ull + (unsigned long long)tv->tv_usec;
+}
+#endif
+
+void ts_case_spawn(void)
+{
+#if !defined(_WIN32)
+    getrusage(RUSAGE_CHILDREN, &ts_spawn_usage);
+    ts_spawn_start = ts_now_ns();
+#endif
+}
+
+void ts_case_exit(int code)
+{
+    unsigned char fixed[28];
+    unsigned long long wall = 0, user = 0, sys = 0;
+    size_t len = 0;
+
+#if !defined(_WIN32)
+    /* Cases are served one at a time, so the growth of the children's usage is the usage of this case */
+    struct rusage usage;
+    if (ts_spawn_start != 0 && getrusage(RUSAGE_CHILDREN, &usage) == 0) {
+        wall = ts_now_ns() - ts_spawn_start;
+        user = ts_timeval_us(&usage.ru_utime) - ts_timeval_us(&ts_spawn_usage.ru_utime);
+        sys = ts_timeval_us(&usage.ru_stime) - ts_timeval_us(&ts_spawn_usage.ru_stime);
+    }
+#endif
+
+    if (ts_channel() < 0) {
+        printf("\n$$EXIT|%d|%llu|%llu|%llu\n", code, wall, user, sys);
+        fflush(stdout);
+    } else {
+        len += ts_put_u32(fixed + len, (unsigned long)code);
+        len += ts_put_u64(fixed + len, wall);
+        len += ts_put_u64(fixed + len, user);
+        len += ts_put_u64(fixed + len, sys);
+        ts_record(TS_REC_EXIT, fixed, len, NULL);
+    }
+}
+
+#if !defined(_WIN32)
+static unsigned long long ts_env_ull(const char *name)
+{
+    const char *value = getenv(name);
+    return value != NULL ? strtoull(value, NULL, 10) : 0;
+}
+
+static void ts_set_limit(int resource, rlim_t soft, rlim_t hard)
+{
+    struct rlimit limit;
+
+    limit.rlim_cur = soft;
+    limit.rlim_max = hard;
+    setrlimit(resource, &limit);
+}
+#endif
+
+void ts_case_limits(void)
+{
+#if !defined(_WIN32)
+    unsigned long long cpu = ts_env_ull("THINGSPECTOR_CPU_LIMIT");
+    unsigned long long memory = ts_env_ull("THINGSPECTOR_MEMORY_LIMIT");
+
+    if (cpu > 0) {
+        /* SIGXCPU at the limit, which tells it apart from other deaths, SIGKILL a second later */
+        ts_set_limit(RLIMIT_CPU, (rlim_t)cpu, (rlim_t)cpu + 1);
+    }
+    if (memory > 0) {
+        ts_set_limit(RLIMIT_AS, (rlim_t)memory, (rlim_t)memory);
+    }
+#endif
+}
+
+#if !defined(_WIN32)
+static void ts_sleep_ns(unsigned long long ns)
+{
+    struct timespec ts;
+
+    ts.tv_sec = (time_t)(ns / 1000000000ull);
+    ts.tv_nsec = (long)(ns % 1000000000ull);
+    nanosleep(&ts, NULL);
+}
+
+int ts_case_wait(int pid)
+{
+    unsigned long long timeout = ts_env_ull("THINGSPECTOR_TIMEOUT");
+    unsigned long long deadline = ts_now_ns() + timeout * 1000000ull;
+    /* Polls quickly at first, short cases are the common ones */
+    unsigned long long interval = 20000ull;
+    unsigned char fixed[4];
+    int status = 0;
+    pid_t rv;
+
+    for (;;) {
+        rv = waitpid((pid_t)pid, &status, timeout > 0 ? WNOHANG : 0);
+        if (rv == (pid_t)pid) {
+            break;
+        }
+        if (rv < 0 && errno != EINTR) {
+            return -1;
+        }
+
+        if (timeout > 0 && rv == 0) {
+            if (ts_now_ns() >= deadline) {
+                /* The case runs in its own process group */
+                kill(-(pid_t)pid, SIGKILL);
+                kill((pid_t)pid, SIGKILL);
+                while (waitpid((pid_t)pid, &status, 0) < 0 && errno == EINTR) {
+                }
+
+                if (ts_channel() < 0) {
+                    printf("\n$$TIMEOUT|%llu\n", timeout);
+                    fflush(stdout);
+                } else {
+                    ts_record(TS_REC_TIMEOUT, fixed, ts_put_u32(fixed, (unsigned long)timeout), NULL);
+                }
+                break;
+            }
+            ts_sleep_ns(interval);
+            if (interval < 10000000ull) {
+                interval *= 2;
+            }
+        }
+    }
+
+    if (WIFEXITED(status)) {
+        return WEXITSTATUS(status);
+    } else if (WIFSIGNALED(status)) {
+        return -WTERMSIG(status);
+    }
+    return -1;
+}
+#endif
+
+static void ts_report_assert_begin(const char *file, int line)
+{
+    unsigned char fixed[4];
+
+    if (ts_channel() < 0) {
+        printf("$$ASSERT_BEGIN|%s|%d\n", file, line);
+    } else {
+        ts_record(TS_REC_ASSERT_BEGIN, fixed, ts_put_u32(fixed, (unsigned long)line), file);
+    }
+}
+
+void ts_assert_begin(const char *file, int line)
+{
+    ts_assert_file = file;
+    ts_assert_line = line;
+    ts_assert_count++;
+
+    if (!ts_is_quiet()) {
+        ts_report_assert_begin(file, line);
+    }
+}
+
+void ts_assert_ok(void)
+{
+    if (ts_is_quiet()) {
+        return;
+    }
+
+    if (ts_channel() < 0) {
+        puts("$$ASSERT_END|OK");
+    } else {
+        ts_record(TS_REC_ASSERT_OK, NULL, 0, NULL);
+    }
+}
+
+void ts_assert_fail(const char *format, ...)
+{
+    char msg[TS_MAX_RECORD];
+    va_list args;
+
+    va_start(args, format);
+    vsnprintf(msg, sizeof(msg), format, args);
+    va_end(args);
+
+    ts_assert_failed++;
+    if (ts_is_quiet()) {
+        ts_report_assert_begin(ts_assert_file, ts_assert_line);
+    }
+
+    if (ts_channel() < 0) {
+        printf("$$ASSERT_END|%s\n", msg);
+    } else {
+        ts_record(TS_REC_ASSERT_FAIL, NULL, 0, msg);
+    }
+}
+
+static unsigned long long ts_bench_batch(void (*body)(void), unsigned long long iterations)
+{
+    unsigned long long start = ts_now_ns();
+    unsigned long long i;
+
+    for (i = 0; i < iterations; i++) {
+        body();
+    }
+    return ts_now_ns() - start;
+}
+
+static int ts_compare_u64(const void *a, const void *b)
+{
+    unsigned long long x = *(const unsigned long long *)a;
+    unsigned long long y = *(const unsigned long long *)b;
+    return x < y ? -1 : x > y;
+}
+
+void ts_bench_run(int idx, const char *name, void (*body)(void))
+{
+    unsigned long long samples[TS_BENCH_SAMPLES];
+    unsigned long long iterations = 1;
+    unsigned char fixed[40];
+    size_t len = 0;
+    int i;
+
+    /* Calibrate: double the batch size until a batch takes long enough, which also warms up caches and branch
+       predictors. One more batch of the final size finishes the warm-up. */
+    while (ts_bench_batch(body, iterations) < TS_BENCH_BATCH_NS && iterations < TS_BENCH_MAX_ITERATIONS) {
+        iterations *= 2;
+    }
+    ts_bench_batch(body, iterations);
+
+    for (i = 0; i < TS_BENCH_SAMPLES; i++) {
+        samples[i] = ts_bench_batch(body, iterations);
+    }
+    qsort(samples, TS_BENCH_SAMPLES, sizeof(samples[0]), ts_compare_u64);
+
+    /* Batch times are reported as is, Thingspector divides them by the iterations */
+    if (ts_channel() < 0) {
+        printf("$$BENCH|%s|%llu|%d|%llu|%llu|%llu\n", name, iterations, TS_BENCH_SAMPLES, samples[0],
+               samples[TS_BENCH_SAMPLES / 2], samples[(TS_BENCH_SAMPLES - 1) * 95 / 100]);
+        fflush(stdout);
+    } else {
+        len += ts_put_u32(fixed + len, (unsigned long)idx);
+        len += ts_put_u32(fixed + len, TS_BENCH_SAMPLES);
+        len += ts_put_u64(fixed + len, iterations);
+        len += ts_put_u64(fixed + len, samples[0]);
+        len += ts_put_u64(fixed + len, samples[TS_BENCH_SAMPLES / 2]);
+        len += ts_put_u64(fixed + len, samples[(TS_BENCH_SAMPLES - 1) * 95 / 100]);
+        ts_record(TS_REC_BENCH, fixed, len, name);
+    }
+}
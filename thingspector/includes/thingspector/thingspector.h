@@ -9,9 +9,22 @@
 #define __TOSTR(S)   #S
 #define _TOSTR(S)    __TOSTR(S)
 
+/* Runtime (thingspector.c), reports the results to Thingspector */
+void ts_case_begin(int idx, const char *name);
+void ts_case_body_end(void);
+void ts_case_end(void);
+void ts_case_spawn(void);
+void ts_case_exit(int code);
+void ts_case_limits(void);
+int ts_case_wait(int pid);
+void ts_assert_begin(const char *file, int line);
+void ts_assert_ok(void);
+void ts_assert_fail(const char *format, ...);
+void ts_bench_run(int idx, const char *name, void (*body)(void));
+
 #define _ASSERT(V, FILE, LINE, FAILMSG, ...) \
-    puts("$$ASSERT_BEGIN|" FILE "|" _TOSTR(LINE)); \
-    if ((V)) { puts("$$ASSERT_END|OK"); } else { printf("$$ASSERT_END|" FAILMSG "\n", ## __VA_ARGS__); };
+    ts_assert_begin(FILE, LINE); \
+    if ((V)) { ts_assert_ok(); } else { ts_assert_fail(FAILMSG, ## __VA_ARGS__); };
 
 #define EXPECT(V, FAILMSG, ...) _ASSERT(V, __FILE__, __LINE__, FAILMSG, ## __VA_ARGS__)
 
@@ -23,4 +36,20 @@
 #define EXPECT_TRUE(W)      EXPECT((W), "Expected " _TOSTR(W) " to return true, but was false")
 #define EXPECT_FALSE(W)     EXPECT(!(W), "Expected " _TOSTR(W) " to return false, but was true")
 
+/* Heap budgets, which need heap tracking enabled (heap: true in inspect.yaml, or --heap) */
+#ifdef THINGSPECTOR_HEAP
+unsigned long long ts_heap_allocs(void);
+unsigned long long ts_heap_bytes(void);
+unsigned long long ts_heap_live(void);
+unsigned long long ts_heap_peak(void);
+
+#define EXPECT_MAX_HEAP(B)      EXPECT(ts_heap_peak() <= (B), "Expected a heap peak of at most %llu bytes, but was %llu", (unsigned long long)(B), ts_heap_peak())
+#define EXPECT_MAX_ALLOCS(N)    EXPECT(ts_heap_allocs() <= (N), "Expected at most %llu allocations, but were %llu", (unsigned long long)(N), ts_heap_allocs())
+#define EXPECT_HEAP_LIVE(B)     EXPECT(ts_heap_live() == (B), "Expected %llu bytes in use on the heap, but were %llu", (unsigned long long)(B), ts_heap_live())
+#else
+#define EXPECT_MAX_HEAP(B)      EXPECT(0, "Heap tracking is not enabled")
+#define EXPECT_MAX_ALLOCS(N)    EXPECT(0, "Heap tracking is not enabled")
+#define EXPECT_HEAP_LIVE(B)     EXPECT(0, "Heap tracking is not enabled")
+#endif
+
 #endif  // _THINGSPECTOR_H_
@@ -0,0 +1,167 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+# Self-profiling: wall time of the phases of a run (config load, compiling, parsing, running cases, etc.) per module.
+# Disabled by default, in which case recording a phase costs next to nothing. Imported by the CLI before anything
+# else, so it only imports what it needs when reporting.
+
+_enabled = False
+_events = []
+_lock = threading.Lock()
+# The module being worked on by this process, and by the threads testing modules side by side (watch mode, daemon).
+# The latter is kept per context, and carried over to the worker threads of a module by ContextThreadPoolExecutor.
+_module = None
+_context_module = contextvars.ContextVar("module", default=None)
+
+
+class Event:
+    """
+        A timed phase. Times are in seconds, from the (system wide) performance counter, so events of worker
+        processes line up.
+    """
+
+    def __init__(self, phase, start, duration, module=None, detail=None, pid=None, tid=None):
+        self.phase = phase
+        self.start = start
+        self.duration = duration
+        self.module = module
+        self.detail = detail
+        self.pid = pid if pid is not None else os.getpid()
+        self.tid = tid if tid is not None else threading.get_ident()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_module(name, per_thread=False):
+    """
+        Sets the module the following phases of this process (or the calling thread and the threads it hands work to,
+        when per_thread) belong to.
+    """
+    global _module
+    if per_thread:
+        _context_module.set(name)
+    else:
+        _module = name
+
+
+def record(phase, start, duration, detail=None):
+    """
+        Records a phase which has been timed elsewhere (i.e. by a test runner).
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _events.append(Event(phase, start, duration, _context_module.get() or _module, detail))
+
+
+@contextlib.contextmanager
+def phase(name, detail=None):
+    """
+        Times the enclosed block as a phase.
+    """
+    if not _enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter() - start, detail)
+
+
+def take_events():
+    """
+        Removes and returns the events recorded so far, i.e. to hand them from a worker process to the main process.
+    """
+    global _events
+    with _lock:
+        events, _events = _events, []
+    return events
+
+
+def merge(events):
+    """
+        Adds the events recorded by a worker process.
+    """
+    with _lock:
+        _events.extend(events)
+
+
+def log_breakdown():
+    """
+        Logs the total time per phase and per module, largest first. Phases of concurrent threads or processes add
+        up, so totals can exceed the wall time of the run.
+    """
+    from thingspector.utils import log
+
+    with _lock:
+        events = list(_events)
+    if len(events) == 0:
+        return
+
+    phases = {}
+    modules = {}
+    for event in events:
+        total, count, longest = phases.get(event.phase, (0.0, 0, 0.0))
+        phases[event.phase] = (total + event.duration, count + 1, max(longest, event.duration))
+        if event.module is not None:
+            modules[event.module] = modules.get(event.module, 0.0) + event.duration
+
+    width = max(len(name) for name in list(phases) + list(modules))
+    log.info("Profile, per phase:")
+    log.info(" %(phase)s %(total)12s %(count)8s %(longest)12s", phase="phase".ljust(width), total="total (ms)",
+             count="count", longest="max (ms)")
+    for name, (total, count, longest) in sorted(phases.items(), key=lambda p: p[1][0], reverse=True):
+        log.info(" %(phase)s %(total)12.1f %(count)8d %(longest)12.1f", phase=name.ljust(width), total=total * 1e3,
+                 count=count, longest=longest * 1e3)
+
+    if len(modules) > 0:
+        log.info("Profile, per module:")
+        for name, total in sorted(modules.items(), key=lambda m: m[1], reverse=True):
+            log.info(" %(module)s %(total)12.1f", module=name.ljust(width), total=total * 1e3)
+
+
+def write_trace(path):
+    """
+        Writes the events in the Chrome trace event format (chrome://tracing, Perfetto).
+    """
+    import json
+    from thingspector import utils
+
+    with _lock:
+        events = list(_events)
+
+    origin = min((event.start for event in events), default=0.0)
+    trace = []
+    for event in events:
+        args = {}
+        if event.module is not None:
+            args["module"] = event.module
+        if event.detail is not None:
+            args["detail"] = str(event.detail)
+        trace.append({
+            "name": event.phase if event.detail is None else "%s %s" % (event.phase, event.detail),
+            "cat": event.phase,
+            "ph": "X",
+            "ts": round((event.start - origin) * 1e6, 3),
+            "dur": round(event.duration * 1e6, 3),
+            "pid": event.pid,
+            "tid": event.tid,
+            "args": args
+        })
+
+    try:
+        utils.write_atomic(path, json.dumps({"traceEvents": trace, "displayTimeUnit": "ms"}))
+    except OSError as e:
+        raise RuntimeError("Unable to write trace %s: %s" % (path, e))
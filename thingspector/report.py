@@ -0,0 +1,40 @@
+import json
+from thingspector import utils
+from thingspector.runner import TestResult
+
+# Machine-readable test results, as written by "t --report <file>"
+
+REPORT_VERSION = 1
+
+
+def write_report(path, results):
+    """
+        Writes the results of a test run as JSON.
+        :param path:    Path of the report file
+        :param results: List of TestResult
+    """
+    report = {
+        "version": REPORT_VERSION,
+        "modules": [result.to_dict() for result in results]
+    }
+    try:
+        utils.write_atomic(path, json.dumps(report, indent=1))
+    except OSError as e:
+        raise RuntimeError("Unable to write report %s: %s" % (path, e))
+
+
+def read_report(path):
+    """
+        Reads a report written by write_report.
+        :return: List of TestResult
+    """
+    try:
+        with open(str(path), "r") as stream:
+            report = json.load(stream)
+    except (OSError, ValueError) as e:
+        raise RuntimeError("Unable to read report %s: %s" % (path, e))
+
+    if report.get("version") != REPORT_VERSION:
+        raise RuntimeError("Report %s has an unsupported version" % path)
+
+    return [TestResult.from_dict(d) for d in report["modules"]]
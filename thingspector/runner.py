@@ -1,9 +1,20 @@
 import os
 from thingspector import builder
-import pycparser as cp
+from thingspector import cindex
 from thingspector import templates as tpl
-from thingspector.utils import log, exec2str, exec4iter
-import subprocess
+from thingspector import channel
+from thingspector import profiler
+from thingspector import utils
+from thingspector.utils import log, exec2str, exec2channel, Path
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import contextvars
+import io
+import json
+import math
+import signal
+import sys
+import time
 
 
 def show_attrs(obj):
@@ -15,23 +26,170 @@ def show_attrs(obj):
 _compilers = None
 _path = os.path.dirname(__file__)
 
+# Results are reported through a dedicated pipe, except on Windows where file descriptors can not be handed over
+USE_CHANNEL = not builder.IS_WINDOWS
+
+# Hardware counters reported by the runtime, in record order
+PERF_COUNTERS = ("instructions", "cycles", "cache_misses")
+
+
+class CaseResult:
+    """
+        Outcome of a single test case.
+    """
+
+    def __init__(self, idx, name="<unknown>"):
+        self.idx = idx
+        self.name = name
+        self.assert_count = 0
+        self.assert_failed = 0
+        self.fatal = False
+        # Killed after its timeout, or stopped for exceeding its CPU time (both fatal as well)
+        self.timeout = False
+        self.limit = False
+        self.returncode = 0
+        # Duration of the case body (ns), as measured by the runner
+        self.duration = None
+        # Resource usage of the case process in seconds, when known
+        self.wall = None
+        self.user = None
+        self.sys = None
+        # Hardware counters of the case body (instructions, cycles, cache_misses), when the kernel allows them
+        self.counters = {}
+        # Allocations, bytes, peak and leaked bytes, when heap tracking is enabled
+        self.heap = None
+        # Not run, but taken from an earlier passing run of the same binary
+        self.cached = False
+
+    def passed(self):
+        return not self.fatal and self.assert_failed == 0
+
+    def cpu(self):
+        """
+        :return: CPU time (user plus system) in seconds, or None when not known
+        """
+        return self.user + self.sys if self.user is not None else None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(d):
+        result = CaseResult(d["idx"])
+        result.__dict__.update(d)
+        return result
+
+
+class TestResult:
+    """
+        Outcome of testing a single module.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.cases = 0
+        self.cases_fatal = 0
+        self.cases_timeout = 0
+        self.cases_limit = 0
+        self.cases_cached = 0
+        self.assert_count = 0
+        self.assert_failed = 0
+        # Set when the module could not be built or run at all
+        self.error = None
+        # Log output, when the module was tested on a worker process
+        self.output = ""
+        # CaseResult of each case, in case order
+        self.case_results = []
+        # BenchResult of each benchmark, when benchmarks were run
+        self.benches = []
+        # Heap use over all cases, when heap tracking is enabled: allocations, bytes, the highest peak of a case and
+        # the bytes leaked
+        self.heap = None
+
+    def failed(self):
+        return self.error is not None or self.cases_fatal > 0 or self.assert_failed > 0
+
+    def add_case(self, case):
+        self.case_results.append(case)
+        self.assert_count += case.assert_count
+        self.assert_failed += case.assert_failed
+        if case.fatal:
+            self.cases_fatal += 1
+        if case.timeout:
+            self.cases_timeout += 1
+        if case.limit:
+            self.cases_limit += 1
+        if case.cached:
+            self.cases_cached += 1
+        if case.heap is not None and self.heap is not None:
+            self.heap = [self.heap[0] + case.heap[0], self.heap[1] + case.heap[1], max(self.heap[2], case.heap[2]),
+                         self.heap[3] + case.heap[3]]
+
+    def to_dict(self):
+        d = dict(self.__dict__)
+        del d["output"]
+        d["case_results"] = [case.to_dict() for case in self.case_results]
+        d["benches"] = [bench.to_dict() for bench in self.benches]
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        result = TestResult(d["name"])
+        result.__dict__.update(d)
+        result.case_results = [CaseResult.from_dict(case) for case in d["case_results"]]
+        result.benches = [BenchResult.from_dict(bench) for bench in d["benches"]]
+        return result
+
+
+class BenchResult:
+    """
+        Timing of a single benchmark, per iteration of its body.
+    """
+
+    def __init__(self, name, iterations, samples, t_min, t_median, t_p95):
+        self.name = name
+        # Iterations per sample (batch)
+        self.iterations = iterations
+        self.samples = samples
+        # Nanoseconds per iteration
+        self.min = t_min / iterations
+        self.median = t_median / iterations
+        self.p95 = t_p95 / iterations
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(d):
+        return BenchResult(d["name"], d["iterations"], d["samples"], d["min"] * d["iterations"],
+                           d["median"] * d["iterations"], d["p95"] * d["iterations"])
+
 
 class Tester:
 
-    def __init__(self, test_desc):
+    def __init__(self, test_desc, jobs=1):
         self.desc = test_desc
+        # Maximum number of concurrent processes this tester may start
+        self.jobs = jobs
         self.modpath = None
         # Test cases as found in the module under test
         self.mod_cases = []
         # Test cases as found in the test file
         self.cases = None
-        self.builder = builder.Build(self.desc.testbin, self.desc.p.workdir)
+        # Benchmarks as found in the test file
+        self.benches = None
+        self.builder = builder.Build(self.desc.testbin, self.desc.p.workdir, self.desc.p.get_compiler())
 
     def __populate_builder(self):
-        self.builder.add_src(self.modpath, self.desc.testsrc, self.desc.runnersrc)
+        self.builder.add_src(self.modpath, self.desc.testsrc, self.desc.runnersrc, builder.RUNTIME_SRC)
         self.builder.add_inc_path(*self.desc.incdirs)
         self.builder.add_symbols(**self.desc.symbols)
 
+        if self.desc.heap:
+            self.builder.add_src(builder.HEAP_SRC)
+            self.builder.add_symbol(builder.HEAP_SYMBOL)
+            self.builder.add_link_flags(*builder.HEAP_LINK_FLAGS)
+
 
     # ===============================================================================================================
     #  Section related to updating the test
@@ -41,41 +199,35 @@ class Tester:
         if self.modpath is not None:
             return
 
-        for srcdir in self.desc.srcdirs:
-            mpc = srcdir + self.desc.target
-            if mpc.is_file():
-                self.modpath = mpc
-                return
+        with profiler.phase("find module"):
+            for srcdir in self.desc.srcdirs:
+                mpc = srcdir + self.desc.target
+                if mpc.is_file():
+                    self.modpath = mpc
+                    return
         raise RuntimeError("Could not find module " + self.desc.target)
 
     def __index_mod_file(self):
         """
             Finds test cases by analyzing the modules C file
         """
-        ast = self.builder.parse(self.modpath)
+        functions = self.builder.index(self.modpath)
 
-        predeclares = []
+        predeclares = [f.name for f in functions if not f.is_definition]
 
         # find all functions
-        for a in ast.ext:
-            # print(a.show())
-            if isinstance(a, cp.c_ast.Decl):
-                if isinstance(a.type, cp.c_ast.FuncDecl):
-                    predeclares.append(a.name)
-
-            if isinstance(a, cp.c_ast.FuncDef):
-                decl = a.decl
-
-                is_predeclared = decl.name in predeclares
-                is_static = 'static' in decl.storage
-                is_inline = 'inline' in decl.funcspec
+        for f in functions:
+            if f.is_definition:
+                is_predeclared = f.name in predeclares
+                is_static = 'static' in f.storage
+                is_inline = 'inline' in f.funcspec
 
-                if is_static and is_inline and decl.name in self.desc.static_inline:
+                if is_static and is_inline and f.name in self.desc.static_inline:
                     pass
                 elif is_static or is_inline or not is_predeclared:
                     continue
 
-                self.mod_cases.append(decl)
+                self.mod_cases.append(f)
 
     def __create_test_file(self):
         """
@@ -95,7 +247,7 @@ class Tester:
             for testfunc in self.mod_cases:
                 t_params = {
                     "case": testfunc.name,
-                    "signature": "TODO"
+                    "signature": testfunc.signature
                 }
 
                 stream.write(tpl.C_TEST_CASE % t_params)
@@ -108,7 +260,7 @@ class Tester:
             for testfunc in new_cases:
                 t_params = {
                     "case": testfunc.name,
-                    "signature": "TODO"
+                    "signature": testfunc.signature
                 }
                 stream.write(tpl.C_TEST_CASE % t_params)
 
@@ -118,36 +270,41 @@ class Tester:
         """
 
         found_cases = []
+        found_benches = []
 
-
-        ast = self.builder.parse(self.desc.testsrc)
+        # Test files are usually plain enough to find the cases without preprocessing and parsing them
+        with profiler.phase("scan", self.desc.testsrc):
+            functions = cindex.scan_file(self.desc.testsrc)
+        if functions is None:
+            log.trace("Test file %(file)s needs to be parsed", file=self.desc.testsrc)
+            functions = self.builder.index(self.desc.testsrc)
 
         has_setup = False
         has_teardown = False
 
-        for a in ast.ext:
-            # print(a.show())
-
-            if isinstance(a, cp.c_ast.FuncDef):
-                decl = a.decl
+        for f in functions:
 
-                is_static = 'static' in decl.storage
-                is_inline = 'inline' in decl.funcspec
+            if f.is_definition:
+                is_static = 'static' in f.storage
+                is_inline = 'inline' in f.funcspec
 
                 if is_static or is_inline:
                     continue
 
-                if decl.name.startswith("case_"):
-                    found_cases.append(decl.name[len("case_"):])
-                elif decl.name == "test_setup":
+                if f.name.startswith("case_"):
+                    found_cases.append(f.name[len("case_"):])
+                elif f.name.startswith("BENCH_"):
+                    found_benches.append(f.name[len("BENCH_"):])
+                elif f.name == "test_setup":
                     has_setup = True
-                elif decl.name == "test_teardown":
+                elif f.name == "test_teardown":
                     has_teardown = True
 
         if not has_setup or not has_teardown:
             raise RuntimeError("Test file invalid, no test_setup() and/or test_teardown()")
 
         self.cases = found_cases
+        self.benches = found_benches
 
     def __create_or_update_test_file(self):
         """
@@ -179,11 +336,12 @@ class Tester:
         """
             Updates the test runner (actually just creates it)
         """
-        if self.desc.runnersrc.is_file() and self.desc.runnersrc.is_newer(self.desc.testsrc):
+        # A runner generated from older templates is regenerated as well
+        if self.desc.runnersrc.is_file() and self.desc.runnersrc.is_newer(self.desc.testsrc, Path(tpl.__file__)):
             return
 
-        if self.cases is None:
-            self.__index_test_cases();
+        # The test file changed since the cases were last indexed (or they never were)
+        self.__index_test_cases()
 
         with open(self.desc.runnersrc.abs_str(), "w") as stream:
 
@@ -198,10 +356,24 @@ class Tester:
                 }
                 casestmtsstr.append(tpl.C_TEST_RUNNER_CASESTMTS % t_params)
 
+            benchfuncstr = []
+            benchstmtsstr = []
+
+            for idx, bench in enumerate(self.benches):
+                benchfuncstr.append(tpl.C_TEST_RUNNER_BENCHFUNCS % bench)
+                t_params = {
+                    "idx": idx,
+                    "benchname": bench
+                }
+                benchstmtsstr.append(tpl.C_TEST_RUNNER_BENCHSTMTS % t_params)
+
             t_params = {
                 "casesn": len(self.cases),
                 "casefuncs": "\n".join(casefuncstr),
-                "casestmts": "\n".join(casestmtsstr)
+                "casestmts": "\n".join(casestmtsstr),
+                "benchn": len(self.benches),
+                "benchfuncs": "\n".join(benchfuncstr),
+                "benchstmts": "\n".join(benchstmtsstr)
             }
 
             stream.write(tpl.C_TEST_RUNNER % t_params)
@@ -212,10 +384,13 @@ class Tester:
         self.__find_module()
         # create the builder definition
         self.__populate_builder()
-        # parse C file
-        self.__index_mod_file()
-        # generate/update test file
-        self.__create_or_update_test_file()
+        try:
+            # parse C file
+            self.__index_mod_file()
+            # generate/update test file
+            self.__create_or_update_test_file()
+        finally:
+            self.builder.save()
 
     # ===============================================================================================================
     #  Section related to running the test
@@ -228,93 +403,353 @@ class Tester:
             log.trace("No need to recompile runner")
             # return
 
-        self.builder.compile_all()
+        self.builder.compile_all(jobs=self.jobs)
 
 
-    def __execute_test(self, *params):
-        assert_file = None
-        assert_line = -1
-        case = "<unknown>"
-        assert_count = 0
-        assert_failed = 0
-        fatal = False
-        try:
-            for line in exec4iter(self.desc.testbin.abs_str(), *params):
-                line = line.strip()
+    def __runner_env(self):
+        """
+            Environment of the test runner: quiet mode and the limits of the cases.
+        """
+        env = {}
+        if self.desc.quiet:
+            env[channel.ENV_QUIET] = "1"
+        if self.desc.timeout is not None:
+            env[channel.ENV_TIMEOUT] = str(int(self.desc.timeout * 1000))
+        if self.desc.cpu_limit is not None:
+            # The kernel counts whole seconds
+            env[channel.ENV_CPU_LIMIT] = str(math.ceil(self.desc.cpu_limit))
+        if self.desc.memory_limit is not None:
+            env[channel.ENV_MEMORY_LIMIT] = str(self.desc.memory_limit)
+        return env
+
+    def __exec_runner(self, *params, input=None, timeout=None):
+        """
+            Runs the test runner with the given parameters. Results come from the result channel when available,
+            otherwise from the text printed on stdout.
+            :param timeout: Seconds after which the runner is killed, which is reported as a TIMEOUT event
+            :return: Tuple of a list of events (see channel), the exit code and the resource usage of the runner
+                     process as (wall, user, system) seconds (None when unknown)
+        """
+        env = self.__runner_env()
 
-                if len(line) == 0:
-                    continue
+        if USE_CHANNEL:
+            output, data, returncode, usage = exec2channel(self.desc.testbin.abs_str(), *params, input=input,
+                                                           env_var=channel.ENV_FD, env=env, timeout=timeout)
+            events = channel.interleave(output, channel.decode(data))
+        else:
+            start = time.perf_counter()
+            output, returncode = exec2str(self.desc.testbin.abs_str(), *params, input=input, env=env,
+                                          timeout=timeout)
+            events = channel.parse_text(output)
+            usage = (time.perf_counter() - start, None, None)
+
+        if returncode is None:
+            events.append((channel.TIMEOUT, int(timeout * 1000)))
+            returncode = -signal.SIGKILL if hasattr(signal, "SIGKILL") else -1
+        return events, returncode, usage
+
+    def __execute_test(self, idx):
+        """
+            Runs a single test case in its own process. Called from worker threads, so it only collects the events.
+        """
+        start = time.perf_counter()
+        outcome = self.__exec_runner(str(idx), timeout=self.desc.timeout)
+        profiler.record("run", start, time.perf_counter() - start, _case_name(outcome[0], idx))
+        return outcome
 
-                # Console output
-                if not line.startswith("$$"):
-                    log.warning("   Console output: %(output)s", output=line)
-                    continue
+    def __execute_tests_forked(self, indices):
+        """
+            Runs the given cases through a single fork-server runner process, which forks a child per case.
+            Console output is attributed to the case which printed it, as it is interleaved with the records.
+            :return: List of (events, returncode, usage) for each case, in the order of indices
+        """
+        start = time.perf_counter()
+        events, returncode, _ = self.__exec_runner("-s", input="".join("%d\n" % idx for idx in indices))
+
+        outcomes = []
+        case_events = []
+        for event in events:
+            if event[0] == channel.EXIT:
+                code, wall, user, sys_time = event[1:]
+                usage = (wall / 1e9, user / 1e6, sys_time / 1e6) if wall > 0 else None
+                # Cases are served one after the other, their start follows from the durations
+                profiler.record("run", start, wall / 1e9, _case_name(case_events, indices[len(outcomes)]))
+                start += wall / 1e9
+                outcomes.append((case_events, code, usage))
+                case_events = []
+            else:
+                case_events.append(event)
+
+        # If the server itself died, the remaining cases never got an exit status
+        while len(outcomes) < len(indices):
+            outcomes.append((case_events, returncode or -1, None))
+            case_events = []
+
+        return outcomes
 
-                p = line.split("|")
-                cmd = p[0][2:]
-                par = p[1:]
-
-                if cmd == "CASE" and len(par) == 1:
-                    case = par[0]
-                    log.verbose(" Case %(case)s", case=case)
-                elif cmd == "ASSERT_BEGIN" and len(par) == 2:
-                    assert_file = par[0]
-                    assert_line = int(par[1])
-                    assert_count += 1
-                elif cmd == "ASSERT_END" and len(par) >= 1:
-                    if par[0] != "OK":
-                        log.warning("  Assertion at %(file)s:%(line)d failed: %(cause)s",
-                                    file=assert_file, line=assert_line, cause="|".join(par))
-                        assert_failed += 1
-                    else:
-                        log.trace("  Assertion at %(file)s:%(line)d success",
-                                  file=assert_file, line=assert_line)
-
-                    assert_file = None
-                else:
-                    log.severe("  Unexpected command sequence: %(seq)s", seq=line)
-
-        except subprocess.CalledProcessError as e:
-            fatal = True
+    def __execute_tests(self, indices):
+        """
+            Runs the given cases, up to jobs processes at a time.
+            :return: Iterator of (idx, (events, returncode, usage)) for each case, in the order of indices
+        """
+        workers = max(1, min(self.jobs, len(indices)))
+
+        if self.desc.runner == "exec":
+            with utils.ContextThreadPoolExecutor(max_workers=workers) as executor:
+                # map() hands the results back in submission order
+                yield from zip(indices, executor.map(self.__execute_test, indices))
+            return
+
+        # Every fork-server gets an interleaved share of the cases
+        chunks = [indices[k::workers] for k in range(workers)]
+        outcomes = {}
+        with utils.ContextThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk, chunk_outcomes in zip(chunks, executor.map(self.__execute_tests_forked, chunks)):
+                outcomes.update(zip(chunk, chunk_outcomes))
+
+        for idx in indices:
+            yield idx, outcomes[idx]
+
+    def __evaluate_test(self, idx, events, returncode, usage):
+        """
+            Interprets the events, exit code and resource usage of a single test case.
+            :return: CaseResult
+        """
+        assert_file = None
+        assert_line = -1
+        timeout = None
+        case = CaseResult(idx)
+        case.returncode = returncode
+        if usage is not None:
+            case.wall, case.user, case.sys = usage
+
+        for event in events:
+            kind = event[0]
+
+            if kind == channel.CONSOLE:
+                log.warning("   Console output: %(output)s", output=event[1])
+            elif kind == channel.CASE:
+                case.name = event[2]
+                log.verbose(" Case %(case)s", case=case.name)
+            elif kind == channel.ASSERT_BEGIN:
+                assert_file = event[1]
+                assert_line = event[2]
+                case.assert_count += 1
+            elif kind == channel.ASSERT_OK:
+                log.trace("  Assertion at %(file)s:%(line)d success",
+                          file=assert_file, line=assert_line)
+                assert_file = None
+            elif kind == channel.ASSERT_FAIL:
+                log.warning("  Assertion at %(file)s:%(line)d failed: %(cause)s",
+                            file=assert_file, line=assert_line, cause=event[1])
+                case.assert_failed += 1
+                assert_file = None
+            elif kind == channel.CASE_END:
+                case.duration = event[1]
+            elif kind == channel.HEAP:
+                case.heap = list(event[1:])
+                if case.heap[3] > 0:
+                    log.warning("  Test case %(case)s leaked %(leaked)d bytes", case=case.name, leaked=case.heap[3])
+            elif kind == channel.PERF:
+                case.counters = {name: value for name, value in zip(PERF_COUNTERS, event[1:]) if value is not None}
+            elif kind == channel.TIMEOUT:
+                timeout = event[1]
+            elif kind == channel.SUMMARY:
+                # Quiet mode, only the failed assertions were reported one by one
+                case.assert_count = event[1]
+                case.assert_failed = event[2]
+            else:
+                log.severe("  Unexpected command sequence: %(seq)s", seq=event[1:])
+
+        if timeout is not None:
+            case.fatal = True
+            case.timeout = True
+            log.severe("  Test case %(case)s timed out after %(timeout)dms%(where)s", case=case.name, timeout=timeout,
+                       where=" in assertion at %s:%d" % (assert_file, assert_line) if assert_file is not None else "")
+        elif returncode and returncode == -getattr(signal, "SIGXCPU", 0):
+            case.fatal = True
+            case.limit = True
+            log.severe("  Test case %(case)s exceeded its CPU time limit of %(limit)ss", case=case.name,
+                       limit=self.desc.cpu_limit)
+        elif returncode:
+            case.fatal = True
             if assert_file is not None:
                 log.severe("  Assertion at %(file)s:%(line)d exited with code 0x%(code)x",
-                                 file=assert_file, line=assert_line, code=e.returncode)
+                                 file=assert_file, line=assert_line, code=returncode)
             else:
                 log.severe("  Test case %(case)s exited with code 0x%(code)x",
-                                 case=case,  code=e.returncode)
+                                 case=case.name,  code=returncode)
 
-        log.info("  Completed %(case)s assertions=%(assert_count)d failed=%(assert_failed)d ",
-                       case=case, assert_count=assert_count, assert_failed=assert_failed)
+        log.info("  Completed %(case)s assertions=%(assert_count)d failed=%(assert_failed)d%(time)s%(cpu)s%(heap)s",
+                       case=case.name, assert_count=case.assert_count, assert_failed=case.assert_failed,
+                       time=" time=%.3fms" % (case.duration / 1e6) if case.duration is not None else "",
+                       cpu=" cpu=%.1fms" % (case.cpu() * 1e3) if case.cpu() is not None else "",
+                       heap=" allocs=%d bytes=%d peak=%d" % tuple(case.heap[:3]) if case.heap is not None else "")
+        if len(case.counters) > 0:
+            log.verbose("   Counters: %(counters)s", counters=", ".join("%s=%d" % c for c in case.counters.items()))
 
-        return assert_count, assert_failed, fatal
+        return case
 
-    def __run_test(self):
+    def __count_runner(self):
         """
-            Run a test script.
+            Asks the test runner for its number of cases and benchmarks.
         """
         capture, rv = exec2str(self.desc.testbin.abs_str())
         capture = capture.split()
-        if len(capture) != 1:
+        if len(capture) != 2 or not all(c.isdigit() for c in capture):
             raise RuntimeError("Failed to run test, unexpected reply")
-        no_of_tests = int(capture[0])
+        return int(capture[0]), int(capture[1])
+
+    def __results_key(self):
+        """
+            Key of the results of this test: the test binary, the declared inputs and the options which change what
+            is reported.
+        """
+        items = [self.desc.testbin.abs_str(), utils.digest_file(self.desc.testbin), "quiet=%s" % self.desc.quiet,
+                 "limits=%s,%s,%s" % (self.desc.timeout, self.desc.cpu_limit, self.desc.memory_limit)]
+        for path in self.desc.inputs:
+            items.append(path.abs_str())
+            items.append(utils.digest_file(path) if path.is_file() else "<missing>")
+        return utils.digest_strings(*items)
+
+    def __load_results(self, key):
+        """
+            Loads the passed cases of the previous run, when it was of the same binary and inputs.
+            :return: Dict of case index to CaseResult, marked as cached
+        """
+        try:
+            with self.desc.resultfile.open("r") as stream:
+                cache = json.load(stream)
+            if cache.get("key") != key:
+                return {}
+            cases = [CaseResult.from_dict(d) for d in cache["cases"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+        for case in cases:
+            case.cached = True
+        return dict((case.idx, case) for case in cases)
+
+    def __save_results(self, key, cases):
+        """
+            Saves the passed cases, so the next run of the same binary and inputs can skip them. Failed and fatal
+            cases always run again.
+        """
+        cache = {
+            "key": key,
+            "cases": [case.to_dict() for case in cases if case.passed()]
+        }
+        try:
+            utils.write_atomic(self.desc.resultfile, json.dumps(cache, separators=(",", ":")))
+        except OSError as e:
+            log.trace("Unable to write results %(file)s: %(error)s", file=self.desc.resultfile, error=e)
+
+    def __run_test(self):
+        """
+            Run a test script. Cases run concurrently, but are evaluated in case order.
+        """
+        no_of_tests, _ = self.__count_runner()
+        indices = list(range(no_of_tests))
+
+        # Only the cases of a shard
+        if self.desc.shard_cases is not None:
+            if self.cases is None:
+                self.__index_test_cases()
+            if len(self.cases) != no_of_tests:
+                raise RuntimeError("Test runner of %s is out of date" % self.desc.name)
+            indices = [idx for idx in indices if self.cases[idx] in self.desc.shard_cases]
 
         log.verbose("Starting test %(name)s", name=self.desc.name)
 
-        assert_count = 0
-        assert_failed = 0
-        cases_fatal = 0
+        result = TestResult(self.desc.name)
+        result.cases = len(indices)
+
+        if self.desc.heap:
+            result.heap = [0, 0, 0, 0]
+
+        key = self.__results_key()
+        cached = self.__load_results(key) if self.desc.result_cache else {}
+
+        cases = {}
+        for idx in indices:
+            if idx in cached:
+                cases[idx] = cached[idx]
+                log.verbose("  Cached %(case)s assertions=%(assert_count)d", case=cached[idx].name,
+                            assert_count=cached[idx].assert_count)
+        for idx, outcome in self.__execute_tests([idx for idx in indices if idx not in cached]):
+            cases[idx] = self.__evaluate_test(idx, *outcome)
+
+        for idx in indices:
+            result.add_case(cases[idx])
+        self.__save_results(key, result.case_results)
+
+        log.info(" Test %(name)s completed, cases=%(casen)d (fatal=%(fatal)d, timeout=%(timeout)d, limit=%(limit)d, " +
+                 "cached=%(cached)d), Assertions total=%(assert_count)d, of which %(assert_failed)d failed",
+                 name=self.desc.name, casen=result.cases, fatal=result.cases_fatal, timeout=result.cases_timeout,
+                 limit=result.cases_limit, cached=result.cases_cached,
+                 assert_count=result.assert_count, assert_failed=result.assert_failed)
+        cpu = [case.cpu() for case in result.case_results if case.cpu() is not None]
+        if len(cpu) > 0:
+            log.info(" Test %(name)s usage: cpu=%(cpu).1fms%(counters)s",
+                     name=self.desc.name, cpu=sum(cpu) * 1e3,
+                     counters="".join(", %s=%d" % (counter, sum(case.counters.get(counter, 0)
+                                                                 for case in result.case_results))
+                                      for counter in PERF_COUNTERS
+                                      if any(counter in case.counters for case in result.case_results)))
+        if result.heap is not None:
+            log.info(" Test %(name)s heap: allocations=%(allocs)d, bytes=%(bytes)d, peak=%(peak)d, leaked=%(leaked)d",
+                     name=self.desc.name, allocs=result.heap[0], bytes=result.heap[1], peak=result.heap[2],
+                     leaked=result.heap[3])
+
+        return result
+
+    def __evaluate_bench(self, events, returncode):
+        """
+            Interprets the events and exit code of a single benchmark.
+            :return: BenchResult, or None when the benchmark did not complete
+        """
+        bench = None
+
+        for event in events:
+            if event[0] == channel.BENCH:
+                bench = BenchResult(*event[2:])
+            elif event[0] == channel.CONSOLE:
+                # Output of the body repeats for every iteration, it is not worth a warning per line
+                log.trace("   Console output: %(output)s", output=event[1])
+            else:
+                log.severe("  Unexpected command sequence: %(seq)s", seq=event[1:])
+
+        if returncode or bench is None:
+            log.severe("  Benchmark exited with code 0x%(code)x", code=returncode)
+            return None
+
+        log.verbose("  Benchmark %(name)s median=%(median).2fns", name=bench.name, median=bench.median)
+        return bench
+
+    def bench(self):
+        """
+            Runs the benchmarks of a compiled test runner, one at a time, so they do not disturb each other.
+            :return: List of BenchResult
+        """
+        _, no_of_benches = self.__count_runner()
+        benches = []
+
+        for idx in range(no_of_benches):
+            events, returncode, _ = self.__exec_runner("-b", str(idx))
+            bench = self.__evaluate_bench(events, returncode)
+            if bench is not None:
+                benches.append(bench)
 
-        for i in range(no_of_tests):
-            a_c, a_f, fatal = self.__execute_test(str(i))
-            assert_count += a_c
-            assert_failed += a_f
-            if fatal:
-                cases_fatal += 1
+        return benches
 
-        log.info(" Test %(name)s completed, cases=%(casen)d (fatal=%(fatal)d), " +
-                 "Assertions total=%(assert_count)d, of which %(assert_failed)d failed",
-                 name=self.desc.name, casen=no_of_tests, fatal=cases_fatal,
-                 assert_count=assert_count, assert_failed=assert_failed)
+    def case_names(self):
+        """
+            Lists the cases of the test file, in runner order, without building anything.
+        """
+        self.__find_module()
+        self.__populate_builder()
+        self.__index_test_cases()
+        return list(self.cases)
 
     def test(self):
         """
@@ -331,7 +766,7 @@ class Tester:
         # Compile it
         self.__compile_module()
         # Run the tests
-        self.__run_test()
+        return self.__run_test()
 
 class Mocker:
     """
@@ -355,8 +790,16 @@ def check_dirs(config):
         config.mockdir.mkdirs()
 
 
+def _case_name(events, idx):
+    """
+        Name of a case, as reported in its events.
+    """
+    return next((event[2] for event in events if event[0] == channel.CASE), "case %d" % idx)
+
+
 def update_test(test):
     check_dirs(test.p)
+    profiler.set_module(test.name)
     tester = Tester(test)
     tester.update()
 
@@ -365,9 +808,252 @@ def update_mock(mock):
     mocker = Mocker(mock)
     mocker.update()
 
-def execute_test(test):
+def execute_test(test, jobs=1):
     check_dirs(test.p)
-    tester = Tester(test)
-    tester.test()
+    profiler.set_module(test.name)
+    tester = Tester(test, jobs)
+    return tester.test()
+
+
+def _execute_test_captured(test, jobs, profile=False):
+    """
+        Tests a module on a worker process. The log output is captured, so the parent can print it in module order.
+        :return: Tuple of the TestResult and the profiler events of the worker
+    """
+    if profile:
+        profiler.enable()
+
+    stream = io.StringIO()
+    with contextlib.redirect_stdout(stream):
+        try:
+            result = execute_test(test, jobs)
+        except RuntimeError as e:
+            result = TestResult(test.name)
+            result.error = str(e)
+    result.output = stream.getvalue()
+    return result, profiler.take_events()
+
+
+class _CapturedOutput:
+    """
+        Standard output shared by threads testing modules side by side. Output written within capture() goes to a
+        buffer of its own, also from the worker threads it hands work to (see utils.ContextThreadPoolExecutor), so
+        it can be printed in module order. Any other output is written through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar("buffer", default=None)
+
+    def capture(self, fn, *args):
+        """
+            Calls fn with its output captured.
+            :return: Tuple of the result of fn and the output
+        """
+        buffer = io.StringIO()
+        token = self.buffer.set(buffer)
+        try:
+            return fn(*args), buffer.getvalue()
+        finally:
+            self.buffer.reset(token)
+
+    def write(self, text):
+        buffer = self.buffer.get()
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def log_expensive_cases(results, count=5):
+    """
+        Logs the cases run which took the most CPU time (or wall time, when the CPU time is not known).
+    """
+    cases = [(result.name, case) for result in results for case in result.case_results if not case.cached]
+    cost = lambda case: case.cpu() if case.cpu() is not None else case.wall
+    cases = sorted((c for c in cases if cost(c[1]) is not None), key=lambda c: cost(c[1]), reverse=True)[:count]
+    if len(cases) == 0:
+        return
+
+    log.info("Most expensive cases:")
+    for name, case in cases:
+        log.info(" %(module)s.%(case)s wall=%(wall).1fms%(cpu)s%(counters)s", module=name, case=case.name,
+                 wall=(case.wall or 0) * 1e3,
+                 cpu=" user=%.1fms sys=%.1fms" % (case.user * 1e3, case.sys * 1e3) if case.user is not None else "",
+                 counters="".join(" %s=%d" % c for c in case.counters.items()))
+
+
+def run_benches(tests, results):
+    """
+        Runs the benchmarks of the tested modules, one at a time and after all testing, so the timings are not
+        disturbed by other processes of Thingspector.
+    """
+    for test, result in zip(tests, results):
+        if result.error is not None:
+            continue
+
+        log.verbose("Benchmarking %(name)s", name=test.name)
+        try:
+            result.benches = Tester(test).bench()
+        except RuntimeError as e:
+            log.severe("Benchmarks of %(name)s failed: %(error)s", name=test.name, error=e)
+
+    rows = [(result.name, bench) for result in results for bench in result.benches]
+    if len(rows) == 0:
+        return
+
+    width = max(len("%s.%s" % (name, bench.name)) for name, bench in rows)
+    log.info("%(bench)s %(iterations)12s %(min)12s %(median)12s %(p95)12s",
+             bench="Benchmark".ljust(width), iterations="iterations", min="min (ns)", median="median (ns)",
+             p95="p95 (ns)")
+    for name, bench in rows:
+        log.info("%(bench)s %(iterations)12d %(min)12.2f %(median)12.2f %(p95)12.2f",
+                 bench=("%s.%s" % (name, bench.name)).ljust(width), iterations=bench.iterations * bench.samples,
+                 min=bench.min, median=bench.median, p95=bench.p95)
+
+
+def log_summary(results):
+    """
+        Logs the errors and totals of a test run.
+    """
+    for result in results:
+        if result.error is not None:
+            log.severe("Test %(name)s failed: %(error)s", name=result.name, error=result.error)
+
+    log.info("Summary: modules=%(modules)d (failed=%(failed)d), cases=%(cases)d (fatal=%(fatal)d, " +
+             "timeout=%(timeout)d, limit=%(limit)d, cached=%(cached)d), assertions=%(assert_count)d, " +
+             "of which %(assert_failed)d failed",
+             modules=len(results), failed=sum(1 for r in results if r.failed()),
+             cases=sum(r.cases for r in results), fatal=sum(r.cases_fatal for r in results),
+             timeout=sum(r.cases_timeout for r in results), limit=sum(r.cases_limit for r in results),
+             cached=sum(r.cases_cached for r in results),
+             assert_count=sum(r.assert_count for r in results),
+             assert_failed=sum(r.assert_failed for r in results))
+    log_expensive_cases(results)
+
+
+def execute_tests(tests, jobs=1, bench=False):
+    """
+        Builds and runs all given tests. Modules are independent, so they are tested concurrently on a process pool.
+        The jobs limit is global: it is shared between the modules and the compilers/cases within each module.
+        :param bench: Run the benchmarks as well, after all tests
+        :return: List of TestResult, in the order of the tests
+    """
+    results = []
+
+    if len(tests) == 0:
+        return results
+
+    for test in tests:
+        check_dirs(test.p)
+
+    workers = max(1, min(jobs, len(tests)))
+    module_jobs = max(1, jobs // workers)
+
+    if workers == 1:
+        for test in tests:
+            try:
+                results.append(execute_test(test, module_jobs))
+            except RuntimeError as e:
+                result = TestResult(test.name)
+                result.error = str(e)
+                results.append(result)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_execute_test_captured, test, module_jobs, profiler.is_enabled())
+                       for test in tests]
+            for future in futures:
+                result, events = future.result()
+                profiler.merge(events)
+                sys.stdout.write(result.output)
+                results.append(result)
+
+    log_summary(results)
+
+    if bench:
+        run_benches(tests, results)
+
+    return results
+
+
 
 
+class Session:
+    """
+        The state kept between test runs by a long running process (watch mode, daemon): the configuration, the
+        compiler and a Tester per module, with its build and indexes.
+    """
+
+    def __init__(self, load_config, jobs=1):
+        """
+        :param load_config: Function which returns the ThingConfig
+        """
+        self.load_config = load_config
+        self.jobs = jobs
+        self.reload()
+
+    def __config_stat(self):
+        try:
+            st = os.stat(self.mf.filename.abs_str())
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def reload(self):
+        """
+            (Re)loads the configuration, dropping all testers.
+        """
+        self.mf = self.load_config()
+        # Resolve the configured compiler once
+        self.mf.get_compiler()
+        self.config_stat = self.__config_stat()
+        self.testers = {}
+
+    def is_stale(self):
+        """
+            Whether the configuration file changed since it was loaded.
+        """
+        return self.__config_stat() != self.config_stat
+
+    def __test_module(self, test, jobs, per_thread=False):
+        profiler.set_module(test.name, per_thread)
+        try:
+            if test.name not in self.testers:
+                self.testers[test.name] = Tester(test, jobs)
+            self.testers[test.name].jobs = jobs
+            return self.testers[test.name].test()
+        except RuntimeError as e:
+            result = TestResult(test.name)
+            result.error = str(e)
+            return result
+
+    def test(self, tests, bench=False):
+        """
+            Tests the given modules in this process, keeping their testers. Like execute_tests, modules are tested
+            concurrently (on threads, the testers stay in this process) and share the jobs limit. The log output of
+            each module is printed in module order, once it is done.
+            :return: List of TestResult, in the order of the tests
+        """
+        for test in tests:
+            check_dirs(test.p)
+
+        workers = max(1, min(self.jobs, len(tests)))
+        module_jobs = max(1, self.jobs // workers)
+
+        if workers == 1:
+            results = [self.__test_module(test, module_jobs) for test in tests]
+        else:
+            results = []
+            output = _CapturedOutput(sys.stdout)
+            with contextlib.redirect_stdout(output), utils.ContextThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(output.capture, self.__test_module, test, module_jobs, True)
+                           for test in tests]
+                for future in futures:
+                    result, text = future.result()
+                    output.stream.write(text)
+                    results.append(result)
+
+        log_summary(results)
+        if bench:
+            run_benches(tests, results)
+        return results
@@ -0,0 +1,123 @@
+from thingspector import cindex
+from thingspector import runner
+from thingspector.utils import log
+
+# Sharding: splitting the (module, case) pairs of a suite over several machines. Every shard computes the same
+# partition from the same inputs (the test files and, optionally, a report with the durations of an earlier run), so
+# the shards need not talk to each other. The reports of the shards are merged afterwards.
+
+
+def parse_shard(text):
+    """
+        Parses a shard specification, "i/N" with i counting from 1.
+        :return: Tuple of the (zero based) shard index and the number of shards
+    """
+    index, _, count = text.partition("/")
+    if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+        raise RuntimeError("Expected a shard as i/N with 1 <= i <= N, got '%s'" % text)
+    return int(index) - 1, int(count)
+
+
+def _durations(timings):
+    """
+        Durations (seconds) per (module, case name) in a list of TestResult.
+    """
+    durations = {}
+    for result in timings:
+        for case in result.case_results:
+            duration = case.wall if case.wall is not None else \
+                case.duration / 1e9 if case.duration is not None else None
+            if duration is not None:
+                durations[(result.name, case.name)] = duration
+    return durations
+
+
+def partition(units, count):
+    """
+        Splits weighted units over count shards with the longest processing time first rule: the most expensive
+        unit goes to the least loaded shard. Ties are broken by name and shard index, so it is deterministic.
+        :param units: List of (cost, key)
+        :return: List of the keys per shard
+    """
+    shards = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for cost, key in sorted(units, key=lambda unit: (-unit[0], unit[1])):
+        shard = min(range(count), key=lambda k: (loads[k], k))
+        shards[shard].append(key)
+        loads[shard] += cost
+    return shards
+
+
+def _case_names(test):
+    """
+        Lists the cases of a test file, in runner order (see Tester.case_names), by scanning it.
+    """
+    functions = cindex.scan_file(test.testsrc)
+    if functions is None:
+        # Too involved to scan, it needs to be preprocessed and parsed
+        return runner.Tester(test).case_names()
+    return [f.name[len("case_"):] for f in functions
+            if f.is_definition and f.name.startswith("case_") and "static" not in f.storage and
+            "inline" not in f.funcspec]
+
+
+def select_shard(tests, index, count, timings=None):
+    """
+        Narrows the tests down to the given shard, and their cases to those of the shard (see
+        TestConfig.shard_cases). Cases are weighed by their duration in timings, when known. Cases without one
+        (i.e. new ones) get the median duration, and without timings all cases weigh the same. Modules without
+        cases go to the first shard, so the merged results still count them.
+        :param timings: List of TestResult of an earlier (complete) run, i.e. read from a report
+        :return: List of the TestConfig with cases in the shard
+    """
+    units = []
+    for test in tests:
+        for case in _case_names(test):
+            units.append((test.name, case))
+
+    durations = _durations(timings or [])
+    known = sorted(durations[unit] for unit in units if unit in durations)
+    default = known[len(known) // 2] if len(known) > 0 else 1.0
+
+    shard = set(partition([(durations.get(unit, default), unit) for unit in units], count)[index])
+
+    with_cases = set(name for name, _ in units)
+    selected = []
+    for test in tests:
+        cases = set(case for name, case in shard if name == test.name)
+        if len(cases) > 0 or (index == 0 and test.name not in with_cases):
+            test.shard_cases = cases
+            selected.append(test)
+
+    log.info("Shard %(index)d/%(count)d: %(cases)d of %(total)d cases, in %(tests)d of %(all)d tests",
+             index=index + 1, count=count, cases=len(shard), total=len(units), tests=len(selected), all=len(tests))
+    return selected
+
+
+def merge(shards):
+    """
+        Merges the results of the shards of a suite, per module.
+        :param shards: List of lists of TestResult, one per shard
+        :return: List of TestResult, in module order of appearance
+    """
+    merged = {}
+    for results in shards:
+        for result in results:
+            if result.name not in merged:
+                merged[result.name] = (runner.TestResult(result.name), [])
+            target, cases = merged[result.name]
+
+            if result.error is not None and target.error is None:
+                target.error = result.error
+            target.cases += result.cases
+            cases.extend(result.case_results)
+            target.benches.extend(result.benches)
+            if result.heap is not None and target.heap is None:
+                target.heap = [0, 0, 0, 0]
+
+    results = []
+    for target, cases in merged.values():
+        for case in sorted(cases, key=lambda case: case.idx):
+            target.add_case(case)
+        results.append(target)
+    return results
@@ -67,10 +67,20 @@ void case_%(case)s()
 
 # Test runner C file:
 #
+# Without arguments it prints the number of cases and benchmarks, with a case index it runs that case and with "-b"
+# and a benchmark index it runs that benchmark. With "-s" it becomes a
+# fork-server (POSIX only): it reads case indices (or "all") from stdin, one per line, runs every case in a forked
+# child and reports its exit status (where a negative code is the signal that killed the child) and resource usage.
+# A forked child gets a process group of its own, so a case which times out is killed with all it started. Results
+# are reported, and limits applied, by the runtime (thingspector.c).
+#
 # Parameters:
 #  * casen    : Number of cases
 #  * casefuncs: formatted string of predefined case-function signatures (see below)
 #  * casestmts: formatted string of case statements (see below)
+#  * benchn    : Number of benchmarks
+#  * benchfuncs: formatted string of predefined benchmark-function signatures (see below)
+#  * benchstmts: formatted string of benchmark statements (see below)
 #
 C_TEST_RUNNER = """\
 /*
@@ -79,22 +89,97 @@ C_TEST_RUNNER = """\
     Do not modify this file! It is automatically generated and will be overwritten on changes.
 */
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "thingspector.h"
+
+#if !defined(_WIN32)
+#include <unistd.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#define TS_FORK_SERVER
+#endif
 
 void test_setup();
 void test_teardown();
 %(casefuncs)s
+%(benchfuncs)s
+
+static void run_case(int idx)
+{
+    ts_case_limits();
+    test_setup();
+    switch (idx)
+    {
+%(casestmts)s
+    }
+    test_teardown();
+    ts_case_end();
+}
+
+static void run_bench(int idx)
+{
+    test_setup();
+    switch (idx)
+    {
+%(benchstmts)s
+    }
+    test_teardown();
+}
+
+#ifdef TS_FORK_SERVER
+static void serve_case(int idx)
+{
+    int code = -1;
+    pid_t pid;
+
+    fflush(stdout);
+    ts_case_spawn();
+    pid = fork();
+    if (pid == 0) {
+        setpgid(0, 0);
+        run_case(idx);
+        fflush(stdout);
+        _exit(0);
+    }
+
+    if (pid > 0) {
+        /* Also here, the child may not have run yet when it has to be killed */
+        setpgid(pid, pid);
+        code = ts_case_wait((int)pid);
+    }
+    ts_case_exit(code);
+}
+
+static void serve()
+{
+    char line[32];
+    int idx;
+
+    while (fgets(line, sizeof(line), stdin) != NULL) {
+        if (strncmp(line, "all", 3) == 0) {
+            for (idx = 0; idx < %(casesn)d; idx++) {
+                serve_case(idx);
+            }
+        } else {
+            serve_case(atoi(line));
+        }
+    }
+}
+#endif
 
 int main( int argc, const char* argv[] )
 {
     if (argc == 1) {
-        puts("%(casesn)d");
+        puts("%(casesn)d %(benchn)d");
+#ifdef TS_FORK_SERVER
+    } else if (strcmp(argv[1], "-s") == 0) {
+        serve();
+#endif
+    } else if (strcmp(argv[1], "-b") == 0 && argc > 2) {
+        run_bench(atoi(argv[2]));
     } else {
-        test_setup();
-        switch (atoi(argv[1]))
-        {
-%(casestmts)s
-        }
-        test_teardown();
+        run_case(atoi(argv[1]));
     }
     return 0;
 }
@@ -115,9 +200,25 @@ C_TEST_RUNNER_CASEFUNCS = "void case_%s();"
 #  * casename : Case name
 #
 C_TEST_RUNNER_CASESTMTS = """\
-        case %(idx)d:
-            puts("$$CASE|%(casename)s");
-            fflush(stdout);
-            case_%(casename)s();
-            break;"""
+    case %(idx)d:
+        ts_case_begin(%(idx)d, "%(casename)s");
+        case_%(casename)s();
+        ts_case_body_end();
+        break;"""
+
+# Test C test runner benchmark function pre-declaration
+#
+#   Parameter (positional):
+#    * benchmark function (i.e. void BENCH_<name>(); ), only the <name> part.
+C_TEST_RUNNER_BENCHFUNCS = "void BENCH_%s();"
 
+# Test runner C benchmark statement:
+#
+# Parameters:
+#  * idx      : Benchmark index
+#  * benchname: Benchmark name
+#
+C_TEST_RUNNER_BENCHSTMTS = """\
+    case %(idx)d:
+        ts_bench_run(%(idx)d, "%(benchname)s", BENCH_%(benchname)s);
+        break;"""
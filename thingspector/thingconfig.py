@@ -1,8 +1,41 @@
-import yaml
 from thingspector.utils import Path
 from thingspector import utils
 from thingspector import builder
 
+_SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def _seconds(value, key):
+    """
+        Parses a positive number of seconds, None when not set.
+    """
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        seconds = -1
+    # Also rejects nan and inf
+    if not 0 < seconds < float("inf"):
+        raise RuntimeError("Expected a positive number of seconds for '%s', got '%s'" % (key, value))
+    return seconds
+
+
+def _size(value, key):
+    """
+        Parses a positive number of bytes, optionally with a K, M or G suffix, None when not set.
+    """
+    if value is None:
+        return None
+    text = str(value).strip().upper()
+    factor = _SIZE_SUFFIXES.get(text[-1:], 1)
+    if factor > 1:
+        text = text[:-1]
+    if not text.isdigit() or int(text) == 0:
+        raise RuntimeError("Expected a positive size (i.e. 256M) for '%s', got '%s'" % (key, value))
+    return int(text) * factor
+
+
 class TestConfig:
     """
         Representation of a Test (module) config.
@@ -32,11 +65,34 @@ class TestConfig:
 
         self.static_inline = set(yaml_section.get("static-inline", []))
 
+        # How the test runner executes cases: "fork" (one runner process forking per case) or "exec" (one runner
+        # process per case)
+        self.runner = yaml_section.get("runner", p.runner)
+        if self.runner not in ThingConfig.RUNNER_MODES:
+            raise RuntimeError("Test %s: unknown runner '%s'" % (name, self.runner))
+
+        # Only report failed assertions, passing ones are just counted by the runner
+        self.quiet = bool(yaml_section.get("quiet", p.quiet))
+        # Track the heap use of each case (GCC with GNU ld only)
+        self.heap = bool(yaml_section.get("heap", p.heap))
+        # Files the cases read at runtime, passed cases are run again when one of them changes
+        self.inputs = Path.to_paths(yaml_section.get("inputs", [])) + p.inputs
+        # Skip cases which passed before (disabled with --no-cache)
+        self.result_cache = True
+        # Names of the cases to run, None for all (set when running a shard of the suite)
+        self.shard_cases = None
+        # Limits per case: wall time and CPU time in seconds, address space in bytes (None when not limited)
+        self.timeout = _seconds(yaml_section.get("timeout"), "timeout") or p.timeout
+        self.cpu_limit = _seconds(yaml_section.get("cpu-limit"), "cpu-limit") or p.cpu_limit
+        self.memory_limit = _size(yaml_section.get("memory-limit"), "memory-limit") or p.memory_limit
+
         self.headers = yaml_section.get("headers", header_guess) + p.headers
 
         self.testsrc = Path(self.p.testdir, "test_%s.c" % self.name)
         self.runnersrc = Path(self.p.workdir, "runner_%s.c" % self.name)
         self.testbin = Path(self.p.workdir, "test_%s%s" % (self.name, builder.EXEC_EXTENSION))
+        # Results of the previous run, to skip the cases which passed when nothing changed
+        self.resultfile = Path(self.p.workdir, "results_%s.json" % self.name)
 
         # print("Module %s, target=%s" % (name, self.target))
 
@@ -48,13 +104,19 @@ class ThingConfig:
 
     __TEST_KEY = "test "
 
+    RUNNER_MODES = ("exec", ) if builder.IS_WINDOWS else ("fork", "exec")
+
     def __init__(self, filename="inspect.yaml"):
+        self.filename = Path(filename)
         self.__load_file(filename)
 
     def __load_file(self, filename):
         if not utils.Path(filename).is_file():
             raise RuntimeError("Expected " + filename + " at working directory")
 
+        # Imported here, only commands which need the configuration pay for it
+        import yaml
+
         with open(filename, "r") as stream:
             y = yaml.load(stream, Loader=yaml.CLoader)
 
@@ -71,9 +133,40 @@ class ThingConfig:
         self.id_symbol = y.get('idsymbol', 'TEST')
         self.symbols = y.get('symbols', {})
         self.symbols[self.id_symbol] = None
+        self.runner = y.get('runner', ThingConfig.RUNNER_MODES[0])
+        self.quiet = bool(y.get('quiet', False))
+        self.heap = bool(y.get('heap', False))
+        self.inputs = Path.to_paths(y.get('inputs', []))
+        self.timeout = _seconds(y.get('timeout'), 'timeout')
+        self.cpu_limit = _seconds(y.get('cpu-limit'), 'cpu-limit')
+        self.memory_limit = _size(y.get('memory-limit'), 'memory-limit')
+        # Compiler executable (name or path), when not set the first compiler found on PATH is used
+        self.compiler_name = y.get('compiler')
+        self.__compiler = None
 
 
         for key in y:
             if key.startswith(ThingConfig.__TEST_KEY):
                 name = key[len(ThingConfig.__TEST_KEY):].strip()
                 self.tests[name] = TestConfig(self, name, y[key])
+
+    def select_tests(self, modules):
+        """
+            Selects the tests for the given module names, or all of them if none are given.
+        """
+        if len(modules) == 0:
+            return list(self.tests.values())
+
+        for module in modules:
+            if module not in self.tests:
+                raise RuntimeError("Unknown module '%s'" % module)
+
+        return [self.tests[module] for module in modules]
+
+    def get_compiler(self):
+        """
+            Returns the configured compiler, or None to use the first compiler found on PATH.
+        """
+        if self.__compiler is None and self.compiler_name is not None:
+            self.__compiler = builder.get_compiler(self.compiler_name)
+        return self.__compiler
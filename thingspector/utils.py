@@ -1,28 +1,176 @@
 import subprocess
+import contextvars
+import hashlib
 import os
-import yaml
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
-def exec2str(*path_list):
+def _environment(env):
+    """
+        The environment of this process, with the variables in env added (if any).
+    """
+    if env is None:
+        return None
+    environment = dict(os.environ)
+    environment.update(env)
+    return environment
+
+
+def exec2str(*path_list, input=None, env=None, timeout=None):
+    """
+        Runs a process and collects what it prints on stdout.
+        :param timeout: Seconds after which the process is killed
+        :return: Tuple of stdout and the return code, which is None when the process was killed after timeout
+    """
     try:
         pipe = subprocess.Popen(path_list,
+                                stdin=subprocess.PIPE if input is not None else None,
                                 stdout=subprocess.PIPE,
-                                universal_newlines=True)
-        rv = pipe.communicate()[0]
+                                universal_newlines=True,
+                                env=_environment(env))
+        try:
+            rv = pipe.communicate(input, timeout=timeout)[0]
+        except subprocess.TimeoutExpired:
+            pipe.kill()
+            return pipe.communicate()[0], None
         return rv, pipe.returncode
     except OSError as e:
         raise RuntimeError("Unable to invoke '%s'. Original error: %s" % (path_list[0], e))
 
-def exec4iter(*path_list):
-    pipe = subprocess.Popen(path_list,
-                            stdout=subprocess.PIPE,
-                            universal_newlines=True)
-    for stdout_line in iter(pipe.stdout.readline, ""):
-        yield stdout_line
-    pipe.stdout.close()
-    return_code = pipe.wait()
-    if return_code:
-        raise subprocess.CalledProcessError(return_code, path_list)
+def exec2channel(*path_list, input=None, env_var=None, env=None, timeout=None):
+    """
+        Like exec2str, but also hands the process the write end of a pipe, of which the number is passed in the
+        environment variable env_var.
+        :param timeout: Seconds after which the process is killed, with all processes it started (its session)
+        :return: Tuple of stdout, everything written to the pipe (bytes), the return code and the resource usage of
+                 the process as (wall, user, system) time in seconds. The return code is None when the process was
+                 killed after timeout.
+    """
+    rfd, wfd = os.pipe()
+    env = _environment(env) or dict(os.environ)
+    env[env_var] = str(wfd)
+
+    start = time.perf_counter()
+    try:
+        pipe = subprocess.Popen(path_list,
+                                stdin=subprocess.PIPE if input is not None else None,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True,
+                                env=env,
+                                pass_fds=(wfd, ),
+                                start_new_session=timeout is not None)
+    except OSError as e:
+        os.close(rfd)
+        raise RuntimeError("Unable to invoke '%s'. Original error: %s" % (path_list[0], e))
+    finally:
+        os.close(wfd)
+
+    # Read the pipe and stdout at the same time, either may fill up
+    chunks = []
+    output = []
+    readers = [threading.Thread(target=lambda: chunks.extend(iter(lambda: os.read(rfd, 1 << 16), b""))),
+               threading.Thread(target=lambda: output.append(pipe.stdout.read()))]
+    for reader in readers:
+        reader.start()
+
+    # Kills the process group, unless the process has been reaped already (and its id may have been reused)
+    lock = threading.Lock()
+    state = {"done": False, "killed": False}
+
+    def kill():
+        with lock:
+            if not state["done"]:
+                state["killed"] = True
+                os.killpg(pipe.pid, signal.SIGKILL)
+
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+
+    try:
+        if input is not None:
+            try:
+                pipe.stdin.write(input)
+                pipe.stdin.close()
+            except BrokenPipeError:
+                # Died before reading everything, the return code tells
+                pass
+
+        # Where waitid allows it, the process is only reaped once the timer can no longer kill it
+        if timer is not None and hasattr(os, "waitid"):
+            os.waitid(os.P_PID, pipe.pid, os.WEXITED | os.WNOWAIT)
+            with lock:
+                state["done"] = True
+
+        # Instead of Popen.wait(), to get the resource usage of the process
+        _, status, rusage = os.wait4(pipe.pid, 0)
+        with lock:
+            state["done"] = True
+        if timer is not None:
+            timer.cancel()
+        pipe.returncode = None if state["killed"] else os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+    finally:
+        for reader in readers:
+            reader.join()
+        pipe.stdout.close()
+        os.close(rfd)
+
+    return "".join(output), b"".join(chunks), pipe.returncode, (wall, rusage.ru_utime, rusage.ru_stime)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+        Thread pool which runs every call in a copy of the context (contextvars) of the thread submitting it, so
+        what is kept per context, like the module of the profiler or captured log output, carries over to the
+        worker threads.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def write_atomic(path, data):
+    """
+        Writes data (str or bytes) to a temporary file next to path and renames it into place, so readers never see
+        a partially written file.
+    """
+    path = str(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    fd, tmpname = tempfile.mkstemp(dir=directory or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as stream:
+            stream.write(data)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def digest_file(path):
+    """
+        SHA-256 digest (hex) of the contents of a file.
+    """
+    h = hashlib.sha256()
+    with open(str(path), "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def digest_strings(*strings):
+    """
+        SHA-256 digest (hex) of a sequence of strings.
+    """
+    return hashlib.sha256("\0".join(strings).encode("utf-8")).hexdigest()
 
 
 class Path:
@@ -152,8 +300,10 @@ class Path:
         return [str(p) for p in paths]
 
 
-yaml.add_representer(Path, lambda dmp, obj: dmp.represent_scalar(u'!path', obj.path))
-yaml.add_constructor(u'!path', lambda ldr, node: Path(ldr.construct_scalar(node)))
+# Per user cache directory, for what can be shared between projects
+CACHE_ROOT = Path(os.environ.get("LOCALAPPDATA" if os.name == 'nt' else "XDG_CACHE_HOME") or
+                  os.path.join(os.path.expanduser("~"), ".cache"), "thingspector")
+
 
 class bc:
     HEADER = '\033[95m'
@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from thingspector import changes
+from thingspector import runner
+from thingspector.utils import log
+
+# Watch mode: test, then wait for changes to the sources and retest the affected modules. The configuration, the
+# compiler and the testers (with their builds and indexes) stay in memory between runs.
+
+# Changes arriving within this many seconds of each other are handled as one (editors often write several files)
+DEBOUNCE = 0.3
+POLL_INTERVAL = 0.5
+
+
+def _ignored(path, dirs):
+    """
+        Hidden files and directories below the watched directory, like the work directory, editor swap files and
+        .git. Only the part of the path below the (innermost) watched directory counts, the project may well live in
+        a hidden directory itself.
+        :param dirs: List of (directory, recursive), as watched
+    """
+    path = os.path.abspath(path)
+    roots = [root for root, _ in dirs if path.startswith(os.path.join(root, ""))]
+    relative = os.path.relpath(path, max(roots, key=len)) if len(roots) > 0 else os.path.basename(path)
+    return any(part.startswith(".") for part in relative.split(os.sep) if part not in (".", ".."))
+
+
+class PollingWatcher:
+    """
+        Detects changes by comparing the modification times of all files every POLL_INTERVAL.
+    """
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.files = self.__snapshot()
+
+    def __snapshot(self):
+        files = {}
+        for root, recursive in self.dirs:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")] if recursive else []
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def wait(self, timeout):
+        """
+        :return: Set of the changed files, empty when nothing changed within timeout (None waits forever)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            files = self.__snapshot()
+            changed = set(path for path in set(files) | set(self.files) if files.get(path) != self.files.get(path))
+            self.files = files
+            if len(changed) > 0:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, max(0, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+        Detects changes with Linux inotify, through ctypes.
+    """
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, dirs):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(InotifyWatcher.IN_NONBLOCK | InotifyWatcher.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.dirs = dirs
+        # Watch descriptor to (directory, recursive)
+        self.watches = {}
+        for root, recursive in dirs:
+            self.__add(root, recursive)
+
+    def __add(self, directory, recursive):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), InotifyWatcher.MASK)
+        if wd >= 0:
+            self.watches[wd] = (directory, recursive)
+        if recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                    self.__add(entry.path, True)
+
+    def wait(self, timeout):
+        """
+        :return: Set of the changed files, empty when nothing changed within timeout (None waits forever)
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+
+        pos = 0
+        while pos + InotifyWatcher.EVENT.size <= len(data):
+            wd, mask, _, length = InotifyWatcher.EVENT.unpack_from(data, pos)
+            name = data[pos + InotifyWatcher.EVENT.size:pos + InotifyWatcher.EVENT.size + length].rstrip(b"\0")
+            pos += InotifyWatcher.EVENT.size + length
+
+            if wd not in self.watches or len(name) == 0:
+                continue
+            directory, recursive = self.watches[wd]
+            path = os.path.join(directory, os.fsdecode(name))
+
+            if mask & InotifyWatcher.IN_ISDIR:
+                if recursive and mask & (InotifyWatcher.IN_CREATE | InotifyWatcher.IN_MOVED_TO) and \
+                        not os.path.basename(path).startswith("."):
+                    self.__add(path, True)
+            else:
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        """
+            Releases the inotify instance, with all its watches.
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(dirs):
+    """
+        Creates an inotify watcher where available, a polling one otherwise.
+        :param dirs: List of (directory, recursive)
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dirs)
+        except (OSError, AttributeError) as e:
+            log.verbose("Unable to use inotify (%(error)s), polling for changes instead", error=e)
+    return PollingWatcher(dirs)
+
+
+def wait_changes(watcher):
+    """
+        Waits for changes, and then for the burst of changes to settle.
+        :return: Set of absolute paths of the changed files
+    """
+    changed = set()
+    while len(changed) == 0:
+        changed = set(os.path.abspath(path) for path in watcher.wait(None) if not _ignored(path, watcher.dirs))
+
+    while True:
+        more = watcher.wait(DEBOUNCE)
+        if len(more) == 0:
+            return changed
+        changed.update(os.path.abspath(path) for path in more if not _ignored(path, watcher.dirs))
+
+
+def _watched_dirs(mf, tests):
+    dirs = {}
+    for test in tests:
+        for directory in test.srcdirs + test.incdirs + [mf.testdir]:
+            if directory.is_dir():
+                dirs[directory.abs_str()] = True
+    # inspect.yaml itself
+    config_dir = os.path.dirname(mf.filename.abs_str())
+    dirs.setdefault(config_dir, False)
+    return sorted(dirs.items())
+
+
+def _affected(session, tests, changed):
+    builds = dict((name, tester.builder) for name, tester in session.testers.items())
+    return changes.affected_tests(tests, changed, session.mf.filename, builds)
+
+
+def watch(load_config, modules, jobs=1):
+    """
+        Tests all (given) modules, and then retests the affected ones on every change until interrupted.
+        :param load_config: Function which returns the ThingConfig
+    """
+    session = runner.Session(load_config, jobs)
+    tests = session.mf.select_tests(modules)
+    session.test(tests)
+
+    watcher = create_watcher(_watched_dirs(session.mf, tests))
+    log.info("Watching for changes, press Ctrl+C to stop")
+
+    try:
+        while True:
+            changed = wait_changes(watcher)
+
+            if session.mf.filename.abs_str() in changed:
+                log.info("Configuration changed, reloading")
+                try:
+                    session.reload()
+                    tests = session.mf.select_tests(modules)
+                except RuntimeError as e:
+                    log.severe("Unable to load the configuration: %(error)s", error=e)
+                    continue
+                watcher.close()
+                watcher = create_watcher(_watched_dirs(session.mf, tests))
+                affected = tests
+            else:
+                affected = _affected(session, tests, changed)
+
+            log.info("%(changed)d files changed, %(affected)d tests affected", changed=len(changed),
+                     affected=len(affected))
+            if len(affected) > 0:
+                session.test(affected)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()